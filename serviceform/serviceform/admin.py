@@ -22,7 +22,8 @@ import collections
 from django.contrib import admin
 from django.conf import settings
 from django.contrib import messages
-from django.db.models import Model, Field
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Model, Field, Prefetch
 from django.forms.utils import pretty_name
 from django.http import HttpRequest
 from django.utils.encoding import force_str
@@ -33,6 +34,8 @@ from guardian.shortcuts import get_objects_for_user, assign_perm
 
 from nested_admin.nested import NestedModelAdmin, NestedTabularInline, NestedStackedInline, \
     NestedModelAdminMixin
+from serviceform.tasks.models import Task
+from serviceform.tasks.pagination import EstimatedCountPaginator, KeysetChangeList
 from . import models, utils
 
 if 'grappelli' in settings.INSTALLED_APPS:
@@ -199,6 +202,18 @@ class ResponsibilityPersonInline(NestedStackedInline):
     readonly_fields = ('personal_link',)
 
 
+class ServiceFormChangeList(ChangeList):
+    """
+    Participation counts and users with access are resolved for the whole page at once
+    """
+    def get_queryset(self, request: HttpRequest):
+        return models.ServiceForm.with_participation_counts(super().get_queryset(request))
+
+    def get_results(self, request: HttpRequest):
+        super().get_results(request)
+        models.ServiceForm.prefetch_can_access(self.result_list)
+
+
 @admin.register(models.ServiceForm)
 class ServiceFormAdmin(OwnerSaveMixin, ExtendedLogMixin, NestedModelAdminMixin,
                        GuardedModelAdminMixin, admin.ModelAdmin):
@@ -212,7 +227,7 @@ class ServiceFormAdmin(OwnerSaveMixin, ExtendedLogMixin, NestedModelAdminMixin,
     if settings.DEBUG:
         superuser_actions.append('shuffle_data')
 
-    actions = superuser_actions
+    actions = superuser_actions + ['copy_forms']
 
     prepopulated_fields = {'slug': ('name',)}
     list_display = (
@@ -296,10 +311,20 @@ class ServiceFormAdmin(OwnerSaveMixin, ExtendedLogMixin, NestedModelAdminMixin,
 
     bulk_email_responsibles.short_description = _('Bulk email responsibility persons now!')
 
+    def copy_forms(self, request: HttpRequest, queryset: Iterable[models.ServiceForm]) -> None:
+        for serviceform in queryset:
+            new_form = serviceform.create_deep_copy()
+            assign_perm('serviceform.can_access_serviceform', request.user, new_form)
+            messages.info(request, _('Created {}').format(new_form))
+
+    copy_forms.short_description = _('Copy forms')
+    copy_forms.allowed_permissions = ('add',)
+
     def shuffle_data(self, request: HttpRequest,
                      queryset: Iterable[models.ServiceForm]) -> None:
         for serviceform in queryset:
-            utils.shuffle_person_data(serviceform)
+            Task.make(serviceform.shuffle_data)
+            messages.info(request, _('Scheduled shuffling of {}').format(serviceform))
 
     shuffle_data.short_description = _('Shuffle participant data')
 
@@ -308,6 +333,9 @@ class ServiceFormAdmin(OwnerSaveMixin, ExtendedLogMixin, NestedModelAdminMixin,
         return get_objects_for_user(request.user, 'serviceform.can_access_serviceform', klass=qs,
                                     use_groups=True)
 
+    def get_changelist(self, request: HttpRequest, **kwargs):
+        return ServiceFormChangeList
+
     def get_form(self, request: HttpRequest, obj: models.ServiceForm=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
         if obj:
@@ -347,10 +375,23 @@ class ServiceFormAdmin(OwnerSaveMixin, ExtendedLogMixin, NestedModelAdminMixin,
         return rv
 
 
+class EmailMessageChangeList(KeysetChangeList):
+    def get_results(self, request: HttpRequest):
+        super().get_results(request)
+        models.EmailMessage.prefetch_display(self.result_list)
+
+
 @admin.register(models.EmailMessage)
 class EmailMessageAdmin(ExtendedLogMixin, admin.ModelAdmin):
     list_display = ('to_address', 'created_at', 'sent_at', 'subject_display', 'template',
                     'content_display',)
+    list_select_related = ('template',)
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request: HttpRequest, **kwargs):
+        return EmailMessageChangeList
 
 
 @admin.register(models.Participant)
@@ -359,11 +400,29 @@ class ParticipantAdmin(ExtendedLogMixin, admin.ModelAdmin):
         'id', '__str__', 'form_display', 'email', 'form_revision', 'status', 'activities_display',
         'created_at', 'last_modified', 'personal_link')
     fields = ('forenames', 'surname', 'email', 'form_revision')
+    ordering = ('-pk',)
+    # Counting all participants for every page is slow with large tables
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request: HttpRequest, **kwargs):
+        return KeysetChangeList
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request).select_related('form_revision__form')
+        qs = super().get_queryset(request)
+        qs = qs.select_related('form_revision', 'form')
+        qs = qs.prefetch_related(
+            Prefetch('participationactivity_set',
+                     queryset=models.ParticipationActivity.objects.select_related('activity')))
         if request.user.is_superuser or settings.OTHER_CAN_SEE_DATA:
             return qs
         allowed_forms = get_objects_for_user(request.user, 'serviceform.can_access_serviceform',
                                              models.ServiceForm)
-        return qs.filter(form_revision__form__in=allowed_forms).distinct()
+        # Subquery instead of join: no duplicate rows, thus no need for distinct()
+        return qs.filter(form_id__in=allowed_forms.values('pk'))
+
+    def activities_display(self, obj: models.Participant) -> str:
+        # Uses prefetched participations (Participant.activities makes a query per row)
+        return ', '.join(pa.activity.name for pa in obj.participationactivity_set.all())
+
+    activities_display.short_description = _('Activities')
@@ -23,3 +23,6 @@ from django.utils.translation import ugettext_lazy as _
 class ServiceformConfig(AppConfig):
     name = 'serviceform.serviceform'
     verbose_name = _('Service form application')
+
+    def ready(self):
+        from . import signals  # noqa: F401
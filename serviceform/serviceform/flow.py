@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# (c) 2017 Tuomas Airaksinen
+#
+# This file is part of Serviceform.
+#
+# Serviceform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Serviceform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import lru_cache
+from typing import Tuple, Dict, Optional
+
+
+class ParticipantFlow:
+    """
+    Immutable state machine of participation flow, compiled from form configuration
+    and participant state by compile_participant_flow. View lookups and transitions are
+    dictionary / tuple lookups.
+    """
+    __slots__ = ('views', '_index', '_last', '_access_limit')
+
+    def __init__(self, views: Tuple[str, ...], last_finished_view: str,
+                 skip_categories: bool) -> None:
+        self.views = views
+        self._index: Dict[str, int] = {name: idx for idx, name in enumerate(views)}
+        self._last = self._index.get(last_finished_view, -1)
+        # Access is granted to next view after last finished view. If categories
+        # can be skipped, participant may go straight from participation view to next view.
+        self._access_limit = self._last + 1 + int(skip_categories)
+
+    def __contains__(self, view_name: str) -> bool:
+        return view_name in self._index
+
+    def can_access(self, view_name: str, auth: bool=False) -> bool:
+        """
+        auth: if query is for authentication (if we can already really proceed to view or not).
+        """
+        if view_name == 'submitted' and not auth:
+            return False
+        return self._index.get(view_name, self._last + 2) <= self._access_limit
+
+    def next_view(self, view_name: str) -> str:
+        return self.views[self._index[view_name] + 1]
+
+    def previous_view(self, view_name: str) -> Optional[str]:
+        idx = self._index.get(view_name)
+        return self.views[idx - 1] if idx else None
+
+    @property
+    def first_unfinished_view(self) -> str:
+        return self.views[self._last + 1]
+
+
+@lru_cache(maxsize=512)
+def compile_participant_flow(has_questions: bool, require_email_verification: bool,
+                             email_verified: bool, has_email: bool, is_published: bool,
+                             flow_by_categories: bool, allow_skipping_categories: bool,
+                             last_finished_view: str) -> ParticipantFlow:
+    from .urls import participant_flow_urls
+
+    if is_published:
+        skipped = set()
+        if not has_questions:
+            skipped.add('questions')
+        if not require_email_verification or email_verified or not has_email:
+            skipped.add('email_verification')
+        views = tuple(i.name for i in participant_flow_urls if i.name not in skipped)
+    else:
+        views = ('contact_details', 'submitted')
+
+    skip_categories = False
+    if flow_by_categories and allow_skipping_categories:
+        # In participation view, allow going straight to questions if skipping categories
+        # is allowed
+        skip_categories = last_finished_view == ('email_verification'
+                                                 if require_email_verification
+                                                 else 'contact_details')
+    return ParticipantFlow(views, last_finished_view, skip_categories)
@@ -18,7 +18,7 @@
 
 import logging
 import re
-from typing import Optional, TYPE_CHECKING, List
+from typing import Optional, TYPE_CHECKING, List, NamedTuple
 
 from django.contrib import messages
 from django.core.exceptions import ValidationError
@@ -44,6 +44,33 @@ if TYPE_CHECKING:
 logger = logging.getLogger('serviceform.forms')
 
 
+class SrvInput(NamedTuple):
+    type: str
+    pk: int
+    extra: bool
+    value: str
+
+
+_srv_key_re = re.compile(r'^SRV_(?P<type>[A-Z]+)(?P<extra>_EXTRA)?_(?P<pk>\d+)$')
+
+
+def parse_srv_inputs(post_data: 'QueryDict') -> List[SrvInput]:
+    """
+    Parse SRV_<TYPE>[_EXTRA]_<pk> keys of participation and question form POST data.
+    Other keys are ignored.
+    """
+    inputs = []
+    for key, value in post_data.items():
+        if not key.startswith('SRV_'):
+            continue
+        match = _srv_key_re.match(key)
+        if not match:
+            raise ValidationError(_('Invalid input data'))
+        inputs.append(SrvInput(match.group('type'), int(match.group('pk')),
+                               bool(match.group('extra')), value))
+    return inputs
+
+
 class MyFormHelper(FormHelper):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -122,9 +149,8 @@ class ParticipantSendEmailForm(Form):
     def clean_email(self):
         email = self.cleaned_data['email']
         if email and 'email' in self.changed_data:
-            participant = models.Participant.objects.filter(
-                email=email,
-                form_revision__form=self.instance).first()
+            participant = models.Participant.objects.filter(email=email,
+                                                            form=self.instance).first()
             if not participant:
                 raise ValidationError(
                     _('There were no participation with email address {}').format(email))
@@ -132,7 +158,7 @@ class ParticipantSendEmailForm(Form):
 
     def save(self):
         participant = models.Participant.objects.filter(email=self.cleaned_data['email'],
-                                                        form_revision__form=self.instance).first()
+                                                        form=self.instance).first()
         success = participant.send_participant_email(models.Participant.EmailIds.RESEND)
         if success:
             messages.info(self.request,
@@ -249,8 +275,7 @@ class ContactForm(ModelForm):
     def clean_email(self):
         email = self.cleaned_data['email']
         if email and 'email' in self.changed_data and \
-                models.Participant.objects.filter(email=email,
-                                                  form_revision__form=self.service_form) \
+                models.Participant.objects.filter(email=email, form=self.service_form) \
                         .exclude(pk=self.participant.pk):
             logger.info('User tried to enter same email address %s again.', email)
             email_link = '<a href="{}">{}</a>'.format(reverse('send_auth_link', args=(email,)),
@@ -320,8 +345,11 @@ class ParticipationForm:
         self.selected_activities = set()
         self.activity_errors = []
         self.form = service_form or self.instance.form
-        assert getattr(self.form, '_counters_initialized',
-                       None), 'Counters are not yet initialized!'
+        if category:
+            assert hasattr(category, '_counter'), 'Counters are not yet initialized!'
+        else:
+            assert getattr(self.form, '_counters_initialized',
+                           None), 'Counters are not yet initialized!'
         self.category = category
         self._fetch_instances()
         if participant and not post_data:
@@ -344,38 +372,76 @@ class ParticipationForm:
                 self.selected_choices.add(choice)
 
     def save(self) -> None:
+        """
+        Write only differences between posted data and stored participation
+        (within activities and choices of this form / category).
+        """
         participant = self.instance
+        for choice in self.selected_choices:
+            self.selected_activities.add(choice.activity)
+        selected_activity_ids = {act.pk for act in self.selected_activities}
+        selected_choice_ids = {choice.pk for choice in self.selected_choices}
+
         with transaction.atomic():
-            for choice in self.selected_choices:
-                self.selected_activities.add(choice.activity)
-            participant.participationactivity_set.filter(
-                activity_id__in=self.all_activities.keys()).exclude(
-                activity__in=self.selected_activities).delete()
+            pacts = {pact.activity_id: pact for pact in
+                     participant.participationactivity_set.filter(
+                         activity_id__in=self.all_activities.keys()).order_by()
+                         .prefetch_related('choices_set')}
+            pchoices = {pchoice.activity_choice_id: pchoice for pact in pacts.values()
+                        for pchoice in pact.choices_set.all()}
+
+            removed_pacts = [pact.pk for act_id, pact in pacts.items()
+                             if act_id not in selected_activity_ids]
+            removed_pchoices = [pchoice.pk for choice_id, pchoice in pchoices.items()
+                                if choice_id not in selected_choice_ids and
+                                pchoice.activity.activity_id in selected_activity_ids]
+            if removed_pacts:
+                models.ParticipationActivity.objects.filter(pk__in=removed_pacts).delete()
+            if removed_pchoices:
+                models.ParticipationActivityChoice.objects.filter(
+                    pk__in=removed_pchoices).delete()
+
+            new_pacts = []
             for act in self.selected_activities:
-                pact, created = models.ParticipationActivity.objects.get_or_create(
-                    participant=participant, activity=act)
-                pact.additional_info = getattr(act, 'extra', None)
-                pact.save(update_fields=['additional_info'])
-            models.ParticipationActivityChoice.objects.filter(activity__participant=participant) \
-                .filter(activity_choice_id__in=self.all_choices.keys()) \
-                .exclude(activity_choice__in=self.selected_choices).delete()
+                extra = getattr(act, 'extra', None)
+                pact = pacts.get(act.pk)
+                if pact is None:
+                    new_pacts.append(models.ParticipationActivity(
+                        participant=participant, activity=act, additional_info=extra))
+                elif pact.additional_info != extra:
+                    pact.additional_info = extra
+                    pact.save(update_fields=['additional_info'])
+            for pact in models.ParticipationActivity.objects.bulk_create(new_pacts):
+                pacts[pact.activity_id] = pact
+
+            new_pchoices = []
             for choice in self.selected_choices:
-                pact = participant.participationactivity_set.get(activity_id=choice.activity_id)
-                pchoice, created = models.ParticipationActivityChoice.objects.get_or_create(
-                    activity=pact,
-                    activity_choice=choice)
-                pchoice.additional_info = getattr(choice, 'extra', None)
-                pchoice.save(update_fields=['additional_info'])
+                extra = getattr(choice, 'extra', None)
+                pchoice = pchoices.get(choice.pk)
+                if pchoice is None:
+                    new_pchoices.append(models.ParticipationActivityChoice(
+                        activity=pacts[choice.activity_id], activity_choice=choice,
+                        additional_info=extra))
+                elif pchoice.additional_info != extra:
+                    pchoice.additional_info = extra
+                    pchoice.save(update_fields=['additional_info'])
+            models.ParticipationActivityChoice.objects.bulk_create(new_pchoices)
+        participant.participation_changed()
 
     def _fetch_instances(self) -> None:
         categories = [self.category] if self.category else self.form.sub_items
+        counts = self.form.participation_counts()
+        activity_counts = counts['activities']
+        choice_counts = counts['choices']
 
         for cat1 in categories:
             for cat2 in cat1.sub_items:
                 for activity in cat2.sub_items:
                     self.all_activities[activity.pk] = activity
+                    activity.participation_count = activity_counts.get(str(activity.pk), 0)
                     for choice in activity.sub_items:
                         self.all_choices[choice.pk] = choice
+                        choice.participation_count = choice_counts.get(str(choice.pk), 0)
 
     def is_valid(self) -> bool:
         try:
@@ -389,52 +455,45 @@ class ParticipationForm:
         return self.activity_errors
 
     def clean(self):
-        for key, value in self.post_data.items():
-            if key.startswith('SRV_'):
-                parts = key.split('_')
-                if 'EXTRA' in parts:
-                    _srv, _type, _extra, _pk = parts
-                else:
-                    _srv, _type, _pk = parts
-                    _extra = None
-                _pk = int(_pk)
-
-                if _type in ['ACTIVITY']:
-                    if _pk not in self.all_activities:
-                        raise ValidationError(_('Invalid activity input data'))
-                    item = self.all_activities[_pk]
-                    if not _extra:
-                        self.selected_activities.add(item)
-                        item.selected = True
-                elif _type == 'ACTIVITYCHOICE':
-                    if _pk not in self.all_activities:
-                        raise ValidationError(_('Invalid activity input data'))
-                    activity = self.all_activities[_pk]
-                    if activity.multiple_choices_allowed:
-                        raise ValidationError(_('Invalid input data in radio button'))
-                    assert isinstance(value, str)
-                    _choice_pk = int(value)
-                    if _choice_pk not in self.all_choices:
-                        raise ValidationError(_('Invalid choice input data'))
-                    item = self.all_choices[_choice_pk]
-                    if not _extra:
-                        self.selected_choices.add(item)
-                        item.selected = True
-
-                elif _type == 'CHOICE':
-                    if _pk not in self.all_choices:
-                        raise ValidationError(_('Invalid choice input data'))
-                    item = self.all_choices[_pk]
-                    if not _extra:
-                        self.selected_choices.add(item)
-                        item.selected = True
-                else:
-                    raise ValidationError(_('Invalid input data'))
+        for inp in parse_srv_inputs(self.post_data):
+            if inp.type == 'ACTIVITY':
+                if inp.pk not in self.all_activities:
+                    raise ValidationError(_('Invalid activity input data'))
+                item = self.all_activities[inp.pk]
+                if not inp.extra:
+                    self.selected_activities.add(item)
+                    item.selected = True
+            elif inp.type == 'ACTIVITYCHOICE':
+                if inp.pk not in self.all_activities:
+                    raise ValidationError(_('Invalid activity input data'))
+                activity = self.all_activities[inp.pk]
+                if activity.multiple_choices_allowed:
+                    raise ValidationError(_('Invalid input data in radio button'))
+                try:
+                    choice_pk = int(inp.value)
+                except ValueError:
+                    raise ValidationError(_('Invalid choice input data'))
+                if choice_pk not in self.all_choices:
+                    raise ValidationError(_('Invalid choice input data'))
+                item = self.all_choices[choice_pk]
+                if not inp.extra:
+                    self.selected_choices.add(item)
+                    item.selected = True
+            elif inp.type == 'CHOICE':
+                if inp.pk not in self.all_choices:
+                    raise ValidationError(_('Invalid choice input data'))
+                item = self.all_choices[inp.pk]
+                if not inp.extra:
+                    self.selected_choices.add(item)
+                    item.selected = True
+            else:
+                raise ValidationError(_('Invalid input data'))
+
+            if inp.extra:
+                item.extra = inp.value
 
-                if _extra:
-                    item.extra = value
         for activity in self.selected_activities:
-            all_choices = set(activity.activitychoice_set.all())
+            all_choices = set(activity.sub_items)
             if all_choices and not all_choices & self.selected_choices:
                 activity.error = _('No choices selected!')
                 self.activity_errors.append(activity)
@@ -448,6 +507,97 @@ class ParticipationForm:
             request=self.request)
 
 
+class ParticipationChangeForm:
+    """
+    Validates and applies a single participation change sent by participation form
+    autosave: activity or choice toggled (SRV_ACTIVITY_<pk>, SRV_CHOICE_<pk>),
+    radio button choice selected (SRV_ACTIVITYCHOICE_<activity pk>) or additional
+    information edited (SRV_ACTIVITY_EXTRA_<pk>, SRV_CHOICE_EXTRA_<pk>).
+
+    Validation is done against ServiceForm.structure_index, without loading the form tree.
+    """
+
+    def __init__(self, participant: models.Participant, post_data: 'QueryDict') -> None:
+        self.instance = participant
+        self.post_data = post_data
+        self.change: Optional[SrvInput] = None
+        self.checked = post_data.get('checked') == 'true'
+        self.activity_id: Optional[int] = None
+        self.choice_id: Optional[int] = None
+        self.cat_num: Optional[int] = None
+
+    def is_valid(self) -> bool:
+        try:
+            self.clean()
+        except ValidationError:
+            return False
+        return True
+
+    def clean(self) -> None:
+        inputs = parse_srv_inputs(
+            {self.post_data.get('name', ''): self.post_data.get('value', '')})
+        if len(inputs) != 1:
+            raise ValidationError(_('Invalid input data'))
+        self.change = inp = inputs[0]
+        index = self.instance.form.structure_index()
+
+        if inp.type == 'ACTIVITY':
+            if str(inp.pk) not in index['activities']:
+                raise ValidationError(_('Invalid activity input data'))
+            self.activity_id = inp.pk
+        elif inp.type == 'CHOICE':
+            if str(inp.pk) not in index['choices']:
+                raise ValidationError(_('Invalid choice input data'))
+            self.choice_id = inp.pk
+            self.activity_id = index['choices'][str(inp.pk)]
+        elif inp.type == 'ACTIVITYCHOICE' and not inp.extra:
+            multiple_choices_allowed = index['activities'].get(str(inp.pk))
+            if multiple_choices_allowed is None or multiple_choices_allowed:
+                raise ValidationError(_('Invalid input data in radio button'))
+            try:
+                self.choice_id = int(inp.value)
+            except ValueError:
+                raise ValidationError(_('Invalid choice input data'))
+            if index['choices'].get(str(self.choice_id)) != inp.pk:
+                raise ValidationError(_('Invalid choice input data'))
+            self.activity_id = inp.pk
+            self.checked = True
+        else:
+            raise ValidationError(_('Invalid input data'))
+        self.cat_num = index['activity_categories'][str(self.activity_id)]
+
+    def save(self) -> None:
+        participant = self.instance
+        inp = self.change
+        pacts = participant.participationactivity_set
+        pchoices = models.ParticipationActivityChoice.objects.filter(
+            activity__participant=participant)
+
+        with transaction.atomic():
+            if inp.extra:
+                if self.choice_id:
+                    pchoices.filter(activity_choice_id=self.choice_id).update(
+                        additional_info=inp.value)
+                else:
+                    pacts.filter(activity_id=self.activity_id).update(additional_info=inp.value)
+            elif self.checked:
+                pact, created = pacts.get_or_create(activity_id=self.activity_id)
+                if self.choice_id:
+                    if inp.type == 'ACTIVITYCHOICE':
+                        pact.choices_set.exclude(activity_choice_id=self.choice_id).delete()
+                    pact.choices_set.get_or_create(activity_choice_id=self.choice_id)
+            elif self.choice_id:
+                pchoices.filter(activity_choice_id=self.choice_id).delete()
+                index = self.instance.form.structure_index()
+                if index['activities'][str(self.activity_id)]:
+                    # Activity with multiple choices is selected only via its choices
+                    pacts.filter(activity_id=self.activity_id,
+                                 choices_set__isnull=True).delete()
+            else:
+                pacts.filter(activity_id=self.activity_id).delete()
+        participant.participation_changed()
+
+
 class QuestionForm:
     """
     Special form class for questions.
@@ -489,6 +639,7 @@ class QuestionForm:
                     q_a.answer = answer
                     q_a.created_at = timezone.now()
                     q_a.save()
+        participant.participation_changed()
 
     def is_valid(self):
         try:
@@ -503,24 +654,13 @@ class QuestionForm:
 
     def clean(self):
         had_values = set()
-        for key, value in self.data.items():
-            if key.startswith('SRV_'):
-                parts = key.split('_')
-                if 'EXTRA' in parts:
-                    _srv, _type, _extra, _pk = parts
-                else:
-                    _srv, _type, _pk = parts
-                    _extra = None
-                _pk = int(_pk)
-
-                assert not _extra
-
-                if _type in ['QUESTION']:
-                    if _pk not in self.questions:
-                        raise ValidationError(_('Invalid question input data'))
-                    item = self.questions[_pk]
-                    item.answer = value
-                    had_values.add(_pk)
+        for inp in parse_srv_inputs(self.data):
+            if inp.type == 'QUESTION':
+                if inp.pk not in self.questions or inp.extra:
+                    raise ValidationError(_('Invalid question input data'))
+                item = self.questions[inp.pk]
+                item.answer = inp.value
+                had_values.add(inp.pk)
 
         for q in self.questions.values():
             if q.pk not in had_values:
@@ -37,7 +37,7 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         activate(settings.LANGUAGE_CODE)
         while True:
-            msgs = EmailMessage.objects.filter(sent_at__isnull=True)
+            msgs = EmailMessage.objects.filter(sent_at__isnull=True).order_by('pk')
             for m in msgs:
                 with DelayedKeyboardInterrupt():
                     m.send()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviceform', '0001_initial'),
+    ]
+
+    operations = [
+        # Single column indexes of these foreign keys are replaced by composite indexes
+        migrations.AlterField(
+            model_name='participant',
+            name='form_revision',
+            field=models.ForeignKey(db_index=False, null=True,
+                                    on_delete=django.db.models.deletion.CASCADE,
+                                    to='serviceform.FormRevision'),
+        ),
+        migrations.AlterField(
+            model_name='participationactivity',
+            name='activity',
+            field=models.ForeignKey(db_index=False,
+                                    on_delete=django.db.models.deletion.CASCADE,
+                                    to='serviceform.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='questionanswer',
+            name='question',
+            field=models.ForeignKey(db_index=False,
+                                    on_delete=django.db.models.deletion.CASCADE,
+                                    to='serviceform.Question'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['form_revision', 'status'],
+                               name='participant_revision_status'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['email', 'form_revision'],
+                               name='participant_email_revision'),
+        ),
+        migrations.AddIndex(
+            model_name='participationactivity',
+            index=models.Index(fields=['activity', 'participant'],
+                               name='participationact_activity'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['question', 'participant'], name='questionanswer_question'),
+        ),
+        # Partial indexes are not supported by Meta.indexes in Django 2.1
+        migrations.RunSQL(
+            'CREATE INDEX emailmessage_unsent ON serviceform_emailmessage (id) '
+            'WHERE sent_at IS NULL',
+            'DROP INDEX emailmessage_unsent',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_participant_forms(apps, schema_editor):
+    Participant = apps.get_model('serviceform', 'Participant')
+    FormRevision = apps.get_model('serviceform', 'FormRevision')
+    Participant.objects.update(form_id=Subquery(
+        FormRevision.objects.filter(pk=OuterRef('form_revision_id')).values('form_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviceform', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='form',
+            field=models.ForeignKey(db_index=False, editable=False, null=True,
+                                    on_delete=django.db.models.deletion.CASCADE,
+                                    to='serviceform.ServiceForm'),
+        ),
+        migrations.RunPython(set_participant_forms, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='participant',
+            name='participant_email_revision',
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['form', 'email'], name='participant_form_email'),
+        ),
+    ]
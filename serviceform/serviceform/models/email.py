@@ -15,17 +15,20 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import json
 import logging
-from typing import TYPE_CHECKING
+from typing import Sequence, TYPE_CHECKING
 
 from django.conf import settings
+from django.core.cache import caches
 from django.core.mail import EmailMultiAlternatives
 from django.db import models
 from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.functional import cached_property
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from raven.contrib.django.raven_compat.models import client
 
@@ -46,6 +49,9 @@ class EmailMessage(models.Model):
     sent_at = models.DateTimeField(null=True)
     context = models.TextField(default="{}")  # JSONified context variables
 
+    # Queue of unsent messages has partial index emailmessage_unsent (WHERE sent_at IS NULL),
+    # created in migration 0002 because partial indexes are not supported in Meta.indexes.
+
     def __str__(self):
         return '<EmailMessage %s to %s>' % (self.pk, self.to_address)
 
@@ -54,15 +60,43 @@ class EmailMessage(models.Model):
         return Context(json.loads(self.context))
 
     def content_display(self) -> str:
+        if '_display' in self.__dict__:
+            return self.__dict__['_display'][1]
         return Template(self.content).render(self.context_dict)
 
     content_display.short_description = _('Content')
 
     def subject_display(self) -> str:
+        if '_display' in self.__dict__:
+            return self.__dict__['_display'][0]
         return Template(self.subject).render(self.context_dict)
 
     subject_display.short_description = _('Subject')
 
+    @classmethod
+    def prefetch_display(cls, messages: 'Sequence[EmailMessage]') -> None:
+        """
+        Render subjects and contents of messages (for admin list), using cached
+        renderings of earlier requests. Rendering depends only on subject, content and
+        context, thus cache key is derived from them.
+        """
+        cache = caches['default']
+        keys = {m.pk: 'email_display_%s' % hashlib.md5(
+            json.dumps([m.subject, m.content, m.context]).encode('utf-8')).hexdigest()
+                for m in messages}
+        cached = cache.get_many(keys.values())
+        missing = {}
+        for m in messages:
+            display = cached.get(keys[m.pk])
+            if display is None:
+                display = missing[keys[m.pk]] = [m.subject_display(), m.content_display()]
+            else:
+                # Cache serializer (JSON) does not preserve SafeString type
+                display = [mark_safe(s) for s in display]
+            m.__dict__['_display'] = display
+        if missing:
+            cache.set_many(missing, getattr(settings, 'EMAIL_DISPLAY_CACHE_TIMEOUT', 24*60*60))
+
     def _cleanup_context(self) -> None:
         context = json.loads(self.context)
         if 'url' in context:
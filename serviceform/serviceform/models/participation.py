@@ -40,11 +40,14 @@ class ParticipantLog(models.Model):
 class ParticipationActivity(models.Model):
     class Meta:
         unique_together = (('participant', 'activity'),)
+        indexes = [models.Index(fields=['activity', 'participant'],
+                                name='participationact_activity'), ]
         ordering = (
         'activity__category__category__order', 'activity__category__order', 'activity__order',)
 
     participant = models.ForeignKey('serviceform.Participant', on_delete=models.CASCADE)
-    activity = models.ForeignKey('serviceform.Activity', on_delete=models.CASCADE)
+    # Indexed by participationact_activity
+    activity = models.ForeignKey('serviceform.Activity', db_index=False, on_delete=models.CASCADE)
     additional_info = models.CharField(max_length=1024, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
@@ -89,12 +92,15 @@ class ParticipationActivityChoice(models.Model):
 
 class QuestionAnswer(models.Model):
     participant = models.ForeignKey('serviceform.Participant', on_delete=models.CASCADE)
-    question = models.ForeignKey('serviceform.Question', on_delete=models.CASCADE)
+    # Indexed by questionanswer_question
+    question = models.ForeignKey('serviceform.Question', db_index=False, on_delete=models.CASCADE)
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
     class Meta:
         ordering = ('question__order',)
+        indexes = [models.Index(fields=['question', 'participant'],
+                                name='questionanswer_question'), ]
 
     @cached_property
     def cached_participant(self) -> 'Participant':
@@ -21,6 +21,8 @@ from typing import Union, Iterator, Tuple, Optional, List, Sequence, TYPE_CHECKI
 from django.conf import settings
 from django.contrib import messages
 from django.db import models
+from django.db.models import Exists, OuterRef
+from django.db.models.query import ModelIterable
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
 from django.urls import reverse
 from django.utils import timezone
@@ -30,12 +32,14 @@ from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 
 from .. import utils
+from ..flow import compile_participant_flow
 from .mixins import CopyMixin, PasswordMixin, ContactDetailsMixinEmail, ContactDetailsMixin
 from .email import EmailMessage
 
 if TYPE_CHECKING:
     from .participation import ParticipationActivity, QuestionAnswer, ParticipantLog
     from .serviceform import ServiceForm
+    from ..flow import ParticipantFlow
 
 
 class ResponsibilityPerson(CopyMixin, PasswordMixin, ContactDetailsMixinEmail, models.Model):
@@ -110,12 +114,27 @@ class ResponsibilityPerson(CopyMixin, PasswordMixin, ContactDetailsMixinEmail, m
             return EmailMessage.make(self.form.bulk_email_to_responsibles, context, self.email)
 
 
+class _FlowParticipantIterable(ModelIterable):
+    """
+    Pass _form_has_questions annotation of Participant.flow_queryset to form
+    """
+
+    def __iter__(self) -> 'Iterator[Participant]':
+        for participant in super().__iter__():
+            if participant.form:
+                participant.form.has_questions = participant._form_has_questions
+            yield participant
+
+
 class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
     email: str
 
     class Meta:
         verbose_name = _('Participant')
         verbose_name_plural = _('Participants')
+        indexes = [models.Index(fields=['form_revision', 'status'],
+                                name='participant_revision_status'),
+                   models.Index(fields=['form', 'email'], name='participant_form_email')]
 
     # Current view is set by view decorator require_authenticated_participant
     _current_view = 'contact_details'
@@ -156,7 +175,13 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
     last_finished = models.DateTimeField(_('Last finished'), null=True)
 
     # Last form revision
-    form_revision = models.ForeignKey('serviceform.FormRevision', null=True, on_delete=models.CASCADE)
+    # Indexed by participant_revision_status
+    form_revision = models.ForeignKey('serviceform.FormRevision', null=True, db_index=False,
+                                      on_delete=models.CASCADE)
+    # Form of form_revision, denormalized to avoid joins in participant lookups.
+    # Maintained in save(). Indexed by participant_form_email.
+    form = models.ForeignKey('serviceform.ServiceForm', null=True, editable=False,
+                             db_index=False, on_delete=models.CASCADE)
 
     email_verified = models.BooleanField(_('Email verified'), default=False)
 
@@ -215,9 +240,42 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
 
     activities_display.short_description = _('Activities')
 
-    @cached_property
-    def form(self) -> 'ServiceForm':
-        return self.form_revision.form if self.form_revision else None
+    @classmethod
+    def from_db(cls, db, field_names, values) -> 'Participant':
+        instance = super().from_db(db, field_names, values)
+        # Remember loaded revision, so that report snapshot of the revision participant
+        # is moved from can be invalidated
+        instance._loaded_form_revision_id = instance.__dict__.get('form_revision_id')
+        return instance
+
+    def save(self, *args, **kwargs) -> None:
+        if self.form_revision_id is None:
+            form_id = None
+        elif (self.form_id is None or
+              self.form_revision_id != getattr(self, '_loaded_form_revision_id', None)):
+            form_id = self.form_revision.form_id
+        else:
+            form_id = self.form_id
+        if form_id != self.form_id:
+            self.form_id = form_id
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'form_revision' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'form'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def flow_queryset(cls) -> 'models.QuerySet':
+        """
+        Participants with related objects that are needed in participation flow
+        (form, its current revision and responsible, and whether form has questions)
+        """
+        from .serviceform import Question
+        qs = cls.objects.select_related(
+            'form_revision', 'form__current_revision', 'form__responsible',
+        ).annotate(_form_has_questions=Exists(
+            Question.objects.filter(form_id=OuterRef('form_id'))))
+        qs._iterable_class = _FlowParticipantIterable
+        return qs
 
     def form_display(self) -> str:
         return str(self.form)
@@ -263,10 +321,18 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
         for r in responsibles:
             r.send_responsibility_email(self)
 
+    def participation_changed(self) -> None:
+        """
+        Participations, answers or log of participant have changed. Cached report
+        fragments of the form are outdated if they may show this participant.
+        """
+        if self.status in self.READY_STATUSES and self.form_id:
+            utils.bump_participation_watermark(self.form_id)
+
     def finish(self, from_user: bool=True) -> None:
         updating = self.status == self.STATUS_UPDATING
         if from_user:
-            self.form_revision = self.form_revision.form.current_revision
+            self.form_revision = self.form.current_revision
         self.status = self.STATUS_FINISHED
         if timezone.now() > self.form_revision.send_emails_after:
             self.send_email_to_responsibles()
@@ -315,20 +381,21 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
     def resend_auth_link(self) -> 'Optional[EmailMessage]':
         return self.send_participant_email(self.EmailIds.RESEND)
 
+    @property
+    def flow_state(self) -> 'ParticipantFlow':
+        """
+        Participation flow state machine for current form configuration and participant state.
+        Compiled flows are cached (see flow.compile_participant_flow).
+        """
+        form = self.form
+        return compile_participant_flow(
+            bool(form.has_questions), form.require_email_verification, self.email_verified,
+            bool(self.email), bool(form.is_published), form.flow_by_categories,
+            form.allow_skipping_categories, self.last_finished_view)
+
     @property
     def flow(self) -> List[str]:
-        from ..urls import participant_flow_urls
-
-        rv = [i.name for i in participant_flow_urls]
-        if not self.form.questions:
-            rv.remove('questions')
-        if not self.form.require_email_verification or self.email_verified:
-            rv.remove('email_verification')
-        if self.form.require_email_verification and not self.email:
-            rv.remove('email_verification')
-        if not self.form.is_published:
-            rv = ['contact_details', 'submitted']
-        return rv
+        return list(self.flow_state.views)
 
     def can_access_view(self, view_name: str, auth: bool=False) -> bool:
         """
@@ -336,31 +403,19 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
 
             auth: if query is for authentication (if we can already really proceed to view or not).
         """
-        if view_name == 'submitted' and not auth:
-            return False
-        last = self.flow.index(
-            self.last_finished_view) if self.last_finished_view in self.flow else -1
-        cur = self.flow.index(view_name) if view_name in self.flow else last + 2
-        if self.form.flow_by_categories and self.form.allow_skipping_categories:
-            # In participation view, allow going straight to questions if skipping categories
-            # is allowed
-            if self.form.require_email_verification:
-                if self.last_finished_view == 'email_verification':
-                    last += 1
-            elif self.last_finished_view == 'contact_details':
-                last += 1
-
-        return cur <= last + 1
+        return self.flow_state.can_access(view_name, auth)
 
     def proceed_to_view(self, next_view: str) -> None:
-        if not self.can_access_view(next_view):
-            _next = self.flow.index(next_view)
-            self.last_finished_view = self.flow[_next - 1]
-            self.save(update_fields=['last_finished_view'])
+        flow = self.flow_state
+        if not flow.can_access(next_view):
+            previous_view = flow.previous_view(next_view)
+            if previous_view:
+                self.last_finished_view = previous_view
+                self.save(update_fields=['last_finished_view'])
 
     @property
     def next_view_name(self) -> str:
-        return self.flow[self.flow.index(self._current_view) + 1]
+        return self.flow_state.next_view(self._current_view)
 
     def redirect_next(self, request: HttpRequest, message: bool=True) -> HttpResponse:
         if self.status == self.STATUS_UPDATING and message:
@@ -369,9 +424,7 @@ class Participant(ContactDetailsMixin, PasswordMixin, models.Model):
         return HttpResponseRedirect(reverse(self.next_view_name))
 
     def redirect_last(self) -> HttpResponse:
-        last = self.flow.index(
-            self.last_finished_view) if self.last_finished_view in self.flow else -1
-        return HttpResponseRedirect(reverse(self.flow[last + 1]))
+        return HttpResponseRedirect(reverse(self.flow_state.first_unfinished_view))
 
     @cached_property
     def log(self) -> 'Sequence[ParticipantLog]':
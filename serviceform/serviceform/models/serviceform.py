@@ -18,35 +18,44 @@
 import datetime
 import string
 import logging
+from collections import defaultdict
 from enum import Enum
-from typing import Tuple, Set, Optional, Sequence, Iterator, Iterable, TYPE_CHECKING
+from typing import Tuple, Set, Optional, Sequence, Iterator, Iterable, Dict, List, TYPE_CHECKING
 
 from colorful.fields import RGBColorField
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db import models
-from django.db.models import Prefetch
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import models, transaction
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import (Prefetch, Count, Avg, Min, Max, F, Q, Value, ExpressionWrapper,
+                              prefetch_related_objects)
+from django.db.models.functions import Cast
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
-from django.utils.html import format_html
+from django.utils.html import format_html, conditional_escape
 from django.utils.translation import ugettext_lazy as _
 from guardian.shortcuts import get_users_with_perms
+from guardian.utils import get_user_obj_perms_model, get_group_obj_perms_model
 from select2 import fields as select2_fields
 
 from serviceform.tasks.models import Task
 
 from .. import emails, utils
+from ..navigation import url_template
 from ..utils import ColorStr
 
 from .mixins import SubitemMixin, NameDescriptionMixin, CopyMixin
 from .people import Participant, ResponsibilityPerson
 from .email import EmailTemplate
-from .participation import QuestionAnswer
+from .participation import QuestionAnswer, ParticipationActivity, ParticipationActivityChoice
 
 if TYPE_CHECKING:
-    from .participation import ParticipationActivity, ParticipationActivityChoice
+    from ..report_data import FormReport
 
 local_tz = timezone.get_default_timezone()
 logger = logging.getLogger(__name__)
@@ -66,6 +75,36 @@ class ColorField(RGBColorField):
 
 
 
+class PercentileCont(models.Aggregate):
+    """
+    PostgreSQL percentile_cont ordered-set aggregate, returning list of given percentiles.
+    """
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(percentiles)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, percentiles: Sequence[float], **extra):
+        percentiles = 'ARRAY[%s]::float[]' % ', '.join('%f' % float(p) for p in percentiles)
+        super().__init__(expression, percentiles=percentiles,
+                         output_field=ArrayField(models.FloatField()), **extra)
+
+
+def _numeric_summary(row: dict) -> dict:
+    """
+    Make JSON serializable summary out of aggregated count, mean, min, max and percentiles.
+    """
+    return {'count': row['count'],
+            'mean': round(float(row['mean']), 2) if row['mean'] is not None else None,
+            'min': row['min'],
+            'max': row['max'],
+            'percentiles': [round(p, 2) for p in row['percentiles'] or []]}
+
+
+def _histogram(rows: Iterable[Tuple[int, int]]) -> List[list]:
+    rows = list(rows)
+    total = sum(count for value, count in rows)
+    return [[value, count, round(100. * count / total, 1)] for value, count in rows]
+
+
 class FormRevision(models.Model):
     class Meta:
         verbose_name = _('Form revision')
@@ -94,6 +133,10 @@ class FormRevision(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def is_closed(self) -> bool:
+        return self.valid_to < timezone.now()
+
 
 class ServiceForm(SubitemMixin, models.Model):
     subitem_name = 'level1category'
@@ -255,21 +298,48 @@ class ServiceForm(SubitemMixin, models.Model):
         USER_EXISTS = 2
 
     def can_access(self) -> str:
-        return ', '.join('%s' % u for u in get_users_with_perms(self))
+        users = self.__dict__.get('_can_access_users')
+        if users is None:
+            users = get_users_with_perms(self)
+        return ', '.join('%s' % u for u in users)
 
     can_access.short_description = _('Can access')
 
-    @cached_property
-    def sub_items(self) -> 'Sequence[AbstractServiceFormItem]':
+    @staticmethod
+    def _subtree_prefetches() -> 'Tuple[Prefetch, ...]':
         lvl2s = Prefetch('level2category_set',
                          queryset=Level2Category.objects.prefetch_related('responsibles'))
         acts = Prefetch('level2category_set__activity_set',
                         queryset=Activity.objects.prefetch_related('responsibles'))
         choices = Prefetch('level2category_set__activity_set__activitychoice_set',
                            queryset=ActivityChoice.objects.prefetch_related('responsibles'))
+        return 'responsibles', lvl2s, acts, choices
+
+    @cached_property
+    def sub_items(self) -> 'Sequence[AbstractServiceFormItem]':
+        return self.level1category_set.prefetch_related(*self._subtree_prefetches())
+
+    @cached_property
+    def level1_categories(self) -> 'Sequence[Level1Category]':
+        """
+        Level 1 categories without their subitems (enough for category navigation).
+        """
+        return list(self.level1category_set.all())
 
-        return self.level1category_set.prefetch_related('responsibles').prefetch_related(
-            lvl2s, acts, choices)
+    def load_category(self, cat_num: int, all_responsibles: bool=True) -> 'Level1Category':
+        """
+        Fetch subitems of only one level 1 category and initialize its counters
+        such that numbering is the same as when counters of the whole form are initialized.
+        """
+        categories = self.level1_categories
+        category = categories[cat_num]
+        prefetch_related_objects([category], *self._subtree_prefetches())
+        activity_offset = Activity.objects.filter(
+            category__category__in=categories[:cat_num], skip_numbering=False).count()
+        # Participation flow does not use count_for_responsible
+        utils.init_category_counters(category, cat_num, activity_offset, all_responsibles,
+                                     resp_count=False)
+        return category
 
     def create_initial_data(self) -> None:
         self.create_email_templates()
@@ -354,7 +424,7 @@ class ServiceForm(SubitemMixin, models.Model):
         """
         logger.info('Invite user %s %s', self, email)
 
-        participant = Participant.objects.filter(email=email, form_revision__form=self).first()
+        participant = Participant.objects.filter(email=email, form=self).first()
         if participant:
             if old_participants and participant.form_revision != self.current_revision:
                 rv = participant.send_participant_email(Participant.EmailIds.INVITE)
@@ -373,6 +443,127 @@ class ServiceForm(SubitemMixin, models.Model):
     def questions(self) -> 'Sequence[Question]':
         return self.question_set.all()
 
+    @cached_property
+    def has_questions(self) -> bool:
+        return self.questions.exists()
+
+    def report(self, revision_name: str) -> 'FormReport':
+        """
+        Participants, participations and question answers of given revision(s), loaded
+        in bulk (or from snapshots of closed revisions). Memoized per revision for
+        this instance.
+        """
+        from ..report_data import FormReport
+        memo = self.__dict__.setdefault('_reports', {})
+        if revision_name not in memo:
+            memo[revision_name] = FormReport.load(self, revision_name)
+        return memo[revision_name]
+
+    def question_answers(self, revision_name: str) -> 'Dict[int, List[QuestionAnswer]]':
+        """
+        Answers of ready participants to all questions of this form, grouped by question pk.
+        """
+        return self.report(revision_name).question_answers
+
+    def revisions(self, revision_name: str) -> 'models.QuerySet':
+        """
+        Revisions of this form selected by report revision setting. Revision names
+        are unique only within a form, so they must not be looked up without it.
+        """
+        qs = self.formrevision_set.all()
+        if revision_name == utils.RevisionOptions.CURRENT:
+            qs = qs.filter(pk=self.current_revision_id)
+        elif revision_name != utils.RevisionOptions.ALL:
+            qs = qs.filter(name=revision_name)
+        return qs
+
+    def ready_participants(self, revision_name: str) -> 'models.QuerySet':
+        # Filtering by revision ids (instead of joining revisions) allows
+        # index participant_revision_status to be used.
+        return Participant.objects.filter(form_revision__in=self.revisions(revision_name),
+                                          status__in=Participant.READY_STATUSES)
+
+    STATISTICS_PERCENTILES = (0.25, 0.5, 0.75)
+
+    def answer_statistics(self, revision_name: str) -> dict:
+        """
+        Statistics of participant ages and question answers in given revision, computed
+        with SQL aggregates: counts, means, minimums, maximums, quartiles and histograms.
+        Cached for ANSWER_STATISTICS_CACHE_TIMEOUT seconds, or until form structure or
+        participations change. Keys are strings so that statistics can be stored in JSON
+        serialized cache.
+        """
+        cache = caches['default']
+        key = 'answer_statistics_%s_%s_%s_%s' % (self.pk, revision_name,
+                                                 utils.form_structure_version(self.pk),
+                                                 utils.participation_watermark(self.pk))
+        statistics = cache.get(key)
+        if statistics is not None:
+            return statistics
+
+        percentiles = self.STATISTICS_PERCENTILES
+        participants = self.ready_participants(revision_name).order_by()
+
+        ages = participants.filter(year_of_birth__isnull=False).annotate(
+            age=ExpressionWrapper(Value(timezone.now().year) - F('year_of_birth'),
+                                  output_field=models.IntegerField()))
+        age_summary = ages.aggregate(count=Count('id'), mean=Avg('age'), min=Min('age'),
+                                     max=Max('age'),
+                                     percentiles=PercentileCont('age', percentiles))
+        age_groups = ages.annotate(
+            group=ExpressionWrapper(F('age') / 10 * 10, output_field=models.IntegerField())
+        ).values_list('group').annotate(Count('id')).order_by('group')
+
+        answers = QuestionAnswer.objects.filter(question__form=self,
+                                                participant__in=participants).order_by()
+        answered = dict(answers.exclude(answer='').values_list('question_id').annotate(
+            Count('id')))
+        false_answers = dict(answers.filter(question__answer_type=Question.ANSWER_BOOL,
+                                            answer__iregex=r'^\s*(false|no|off|0)\s*$')
+                             .values_list('question_id').annotate(Count('id')))
+        integers = answers.filter(question__answer_type=Question.ANSWER_INT,
+                                  answer__regex=r'^\s*-?\d{1,9}\s*$').annotate(
+            value=Cast('answer', models.IntegerField()))
+        integer_summaries = {
+            row['question_id']: _numeric_summary(row) for row in
+            integers.values('question_id').annotate(
+                count=Count('id'), mean=Avg('value'), min=Min('value'), max=Max('value'),
+                percentiles=PercentileCont('value', percentiles))}
+        integer_values = defaultdict(list)
+        for question_id, value, count in integers.values_list('question_id', 'value').annotate(
+                Count('id')).order_by('question_id', 'value'):
+            integer_values[question_id].append((value, count))
+        date_ranges = {question_id: [first, last] for question_id, first, last in
+                       answers.filter(question__answer_type=Question.ANSWER_DATE,
+                                      answer__regex=r'^\d{4}-\d{2}-\d{2}$')
+                       .values_list('question_id').annotate(Min('answer'), Max('answer'))}
+
+        participant_count = participants.count()
+        questions = {}
+        for q in self.questions:
+            stats = {'answered': answered.get(q.pk, 0)}
+            if q.answer_type == Question.ANSWER_INT:
+                stats['summary'] = integer_summaries.get(q.pk)
+                stats['histogram'] = _histogram(integer_values[q.pk])
+            elif q.answer_type == Question.ANSWER_BOOL:
+                # Unchecked checkbox is stored as missing answer
+                stats['yes'] = stats['answered'] - false_answers.get(q.pk, 0)
+                stats['no'] = participant_count - stats['yes']
+            elif q.answer_type == Question.ANSWER_DATE:
+                stats['range'] = date_ranges.get(q.pk)
+            questions[str(q.pk)] = stats
+
+        statistics = {
+            'participants': {
+                'count': participant_count,
+                'age': _numeric_summary(age_summary),
+                'age_histogram': _histogram(age_groups),
+            },
+            'questions': questions,
+        }
+        cache.set(key, statistics, getattr(settings, 'ANSWER_STATISTICS_CACHE_TIMEOUT', 300))
+        return statistics
+
     def activities(self) -> 'Iterator[Activity]':
         for c1 in self.sub_items:
             for c2 in c1.sub_items:
@@ -407,6 +598,81 @@ class ServiceForm(SubitemMixin, models.Model):
             slug += '-copy'
         return slug
 
+    @staticmethod
+    def _bulk_copy(objs: 'Sequence[models.Model]', **remaps: Dict[int, int]) -> Dict[int, int]:
+        """
+        Insert copies of objs in one query. Foreign keys given as keyword arguments
+        (attname=id map) are remapped. Returns map from original pks to pks of copies.
+        """
+        if not objs:
+            return {}
+        model = type(objs[0])
+        fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key]
+        copies = []
+        for obj in objs:
+            copy = model(**{name: getattr(obj, name) for name in fields})
+            for name, id_map in remaps.items():
+                setattr(copy, name, id_map.get(getattr(obj, name)))
+            copies.append(copy)
+        model.objects.bulk_create(copies)
+        return {obj.pk: copy.pk for obj, copy in zip(objs, copies)}
+
+    @transaction.atomic
+    def create_deep_copy(self) -> 'ServiceForm':
+        """
+        Copy this form with its email templates, responsibility persons, categories,
+        activities, choices and questions (but without revisions and participants), copying
+        each level with one bulk insert.
+        """
+        email_fields = [f.attname for f in self._meta.concrete_fields
+                        if f.is_relation and f.related_model is EmailTemplate]
+        form = ServiceForm(**{f.attname: getattr(self, f.attname)
+                              for f in self._meta.concrete_fields if not f.primary_key})
+        form.name = _('Copy of {}').format(self.name)
+        form.slug = self._find_new_slug()
+        form.current_revision_id = form.responsible_id = None
+        for name in email_fields:
+            setattr(form, name, None)
+        form.save()
+        new_form = {self.pk: form.pk}
+
+        templates = self._bulk_copy(list(self.emailtemplate_set.all()), form_id=new_form)
+        responsibles = list(self.responsibilityperson_set.all())
+        for r in responsibles:
+            # Copies must not share credentials
+            r.secret_key = utils.generate_uuid()
+            r.auth_keys_hash_storage = []
+        responsibles = self._bulk_copy(responsibles, form_id=new_form)
+
+        c1s = self._bulk_copy(list(self.level1category_set.all()), form_id=new_form)
+        c2s = self._bulk_copy(list(Level2Category.objects.filter(category__form=self)),
+                              category_id=c1s)
+        activities = self._bulk_copy(
+            list(Activity.objects.filter(category__category__form=self)), category_id=c2s)
+        choices = self._bulk_copy(
+            list(ActivityChoice.objects.filter(activity__category__category__form=self)),
+            activity_id=activities)
+        questions = self._bulk_copy(list(self.question_set.all()), form_id=new_form)
+
+        for model, id_map in ((Level1Category, c1s), (Level2Category, c2s),
+                              (Activity, activities), (ActivityChoice, choices),
+                              (Question, questions)):
+            through = model.responsibles.through
+            item_field = '%s_id' % model._meta.model_name
+            through.objects.bulk_create(
+                through(**{item_field: id_map[item_id],
+                           'responsibilityperson_id': responsibles.get(r_id, r_id)})
+                for item_id, r_id in through.objects.filter(**{item_field + '__in': id_map})
+                .values_list(item_field, 'responsibilityperson_id'))
+
+        form.responsible_id = responsibles.get(self.responsible_id)
+        for name in email_fields:
+            setattr(form, name, templates.get(getattr(self, name)))
+        form.current_revision = FormRevision.objects.create(name='%s' % timezone.now().year,
+                                                            form=form)
+        form.save()
+        return form
+
     def links(self) -> Tuple[str]:
         return (format_html('<a href="{}">{}</a>, ', reverse('report', args=(self.slug,)),
                             _('To report')) +
@@ -422,21 +688,212 @@ class ServiceForm(SubitemMixin, models.Model):
 
     links.short_description = _('Links')
 
+    RECENTLY_ONGOING_MINUTES = 20
+
+    @classmethod
+    def with_participation_counts(cls, qs: 'models.QuerySet') -> 'models.QuerySet':
+        """
+        Annotate forms with counts of ready and recently ongoing participants of their
+        current revisions, to be shown by participation_count without further queries.
+        """
+        old_time = timezone.now() - datetime.timedelta(minutes=cls.RECENTLY_ONGOING_MINUTES)
+        status = 'current_revision__participant__status'
+        return qs.annotate(
+            ready_participant_count=Count('current_revision__participant', filter=Q(
+                **{status + '__in': Participant.READY_STATUSES})),
+            ongoing_participant_count=Count('current_revision__participant', filter=Q(
+                **{status: Participant.STATUS_ONGOING,
+                   'current_revision__participant__last_modified__gt': old_time})))
+
+    @classmethod
+    def prefetch_can_access(cls, service_forms: 'Sequence[ServiceForm]') -> None:
+        """
+        Resolve users that have permissions to given forms (directly or via groups, like
+        get_users_with_perms) in bulk, to be shown by can_access without further queries.
+        """
+        if not service_forms:
+            return
+        content_type = ContentType.objects.get_for_model(cls)
+        object_pks = [str(f.pk) for f in service_forms]
+        user_ids = defaultdict(set)
+        for perm_model, user_field in ((get_user_obj_perms_model(cls), 'user_id'),
+                                       (get_group_obj_perms_model(cls), 'group__user')):
+            for object_pk, user_id in perm_model.objects.filter(
+                    content_type=content_type, object_pk__in=object_pks).values_list(
+                    'object_pk', user_field):
+                if user_id is not None:
+                    user_ids[object_pk].add(user_id)
+        users = get_user_model().objects.in_bulk(set().union(*user_ids.values()))
+        for f in service_forms:
+            f.__dict__['_can_access_users'] = [users[pk] for pk in sorted(user_ids[str(f.pk)])]
+
     def participation_count(self) -> str:
-        if self.current_revision:
-            old_time = timezone.now() - datetime.timedelta(minutes=20)
-            ready = self.current_revision.participant_set.filter(
-                status__in=Participant.READY_STATUSES)
-            recent_ongoing = self.current_revision.participant_set.filter(
-                status__in=[Participant.STATUS_ONGOING],
-                last_modified__gt=old_time)
-
-            return '%s + %s' % (ready.count(), recent_ongoing.count())
-        else:
+        if not self.current_revision_id:
             return '0'
+        if hasattr(self, 'ready_participant_count'):
+            return '%s + %s' % (self.ready_participant_count, self.ongoing_participant_count)
+        old_time = timezone.now() - datetime.timedelta(minutes=self.RECENTLY_ONGOING_MINUTES)
+        ready = self.current_revision.participant_set.filter(
+            status__in=Participant.READY_STATUSES)
+        recent_ongoing = self.current_revision.participant_set.filter(
+            status__in=[Participant.STATUS_ONGOING],
+            last_modified__gt=old_time)
+
+        return '%s + %s' % (ready.count(), recent_ongoing.count())
 
     participation_count.short_description = _('Participation count')
 
+    def participation_counts(self, refresh: bool=False) -> Dict[str, Dict[str, int]]:
+        """
+        Snapshot of ready participations in current revision, per activity and per
+        activity choice: {'activities': {pk: count}, 'choices': {pk: count}}. Keys are strings
+        so that snapshot can be stored in JSON serialized cache.
+
+        Snapshot is cached for PARTICIPATION_COUNTS_CACHE_TIMEOUT seconds and refreshed
+        periodically by tasks.update_participation_counts.
+        """
+        cache = caches['default']
+        key = 'participation_counts_%s' % self.pk
+        counts = None if refresh else cache.get(key)
+        if counts is None:
+            activities = ParticipationActivity.objects.filter(
+                participant__form_revision_id=self.current_revision_id,
+                participant__status__in=Participant.READY_STATUSES)
+            choices = ParticipationActivityChoice.objects.filter(
+                activity__participant__form_revision_id=self.current_revision_id,
+                activity__participant__status__in=Participant.READY_STATUSES)
+            counts = {
+                'activities': {str(pk): count for pk, count in activities.order_by()
+                               .values_list('activity_id').annotate(Count('id'))},
+                'choices': {str(pk): count for pk, count in choices.order_by()
+                            .values_list('activity_choice_id').annotate(Count('id'))},
+            }
+            cache.set(key, counts, getattr(settings, 'PARTICIPATION_COUNTS_CACHE_TIMEOUT', 300))
+        return counts
+
+    def structure_index(self) -> Dict[str, dict]:
+        """
+        Lightweight index of activities and choices of this form for validating
+        single participation changes without loading the whole form tree:
+        {'activities': {pk: multiple_choices_allowed}, 'choices': {pk: activity_pk},
+        'activity_categories': {pk: level 1 category number}}.
+        Keys are strings so that index can be stored in JSON serialized cache.
+        """
+        cache = caches['default']
+        key = 'form_structure_%s_%s' % (self.pk, utils.form_structure_version(self.pk))
+        index = cache.get(key)
+        if index is None:
+            activities = Activity.objects.filter(category__category__form=self).order_by()
+            choices = ActivityChoice.objects.filter(
+                activity__category__category__form=self).order_by()
+            cat_nums = {pk: cat_num for cat_num, pk in
+                        enumerate(self.level1category_set.values_list('pk', flat=True))}
+            activity_rows = activities.values_list('pk', 'multiple_choices_allowed',
+                                                   'category__category_id')
+            index = {
+                'activities': {str(pk): multiple for pk, multiple, cat_id in activity_rows},
+                'choices': {str(pk): activity_id for pk, activity_id in
+                            choices.values_list('pk', 'activity_id')},
+                'activity_categories': {str(pk): cat_nums[cat_id]
+                                        for pk, multiple, cat_id in activity_rows},
+            }
+            cache.set(key, index)
+        return index
+
+    def palette(self) -> Dict[str, ColorStr]:
+        """
+        Background colors of categories, activities and choices of this form
+        as {css class: color}, in all lightness levels used in templates
+        (see utils.palette_class). Computed once per structure version.
+        """
+        if '_palette' in self.__dict__:
+            return self.__dict__['_palette']
+        cache = caches['default']
+        key = 'form_palette_%s_%s' % (self.pk, utils.form_structure_version(self.pk))
+        palette = cache.get(key)
+        if palette is None:
+            palette = {}
+            c1s = self.level1category_set.prefetch_related(
+                'level2category_set__activity_set__activitychoice_set')
+            for c1 in c1s:
+                items = [c1]
+                for c2 in c1.sub_items:
+                    items.append(c2)
+                    for a in c2.sub_items:
+                        items.append(a)
+                        items.extend(a.sub_items)
+                for item in items:
+                    color = item.background_color_display
+                    if not color:
+                        continue
+                    for lighter in utils.PALETTE_LIGHTNESS_LEVELS:
+                        palette[utils.palette_class(item, lighter)] = color
+                        color = utils.lighter_color(color)
+            cache.set(key, palette)
+        self.__dict__['_palette'] = palette
+        return palette
+
+    def palette_css(self) -> str:
+        # !important because colors used to be given in style attributes, which
+        # override backgrounds defined in serviceform.scss.
+        return ''.join('.%s{background:%s !important}\n' % (cls, color)
+                       for cls, color in sorted(self.palette().items()))
+
+    @property
+    def palette_url(self) -> str:
+        return reverse('form_palette', args=(self.slug,
+                                             utils.form_structure_version(self.pk)))
+
+    def responsible_links(self) -> Dict[str, Dict[str, str]]:
+        """
+        Markup of responsible person links of categories, activities and choices of this
+        form (see responsible_link template tag), as {item key: {'': markup}}.
+        Items' responsibles see their own names without link: those variants are
+        stored under responsible pk. Computed in one pass over the responsibles
+        tables, once per structure version (which is also changed when responsibles
+        are edited, see signals.py).
+        """
+        if '_responsible_links' in self.__dict__:
+            return self.__dict__['_responsible_links']
+        cache = caches['default']
+        key = 'responsible_links_%s_%s' % (self.pk, utils.form_structure_version(self.pk))
+        links = cache.get(key)
+        if links is None:
+            item_responsibles = defaultdict(list)
+            for model, form_path in ((Level1Category, 'form'),
+                                     (Level2Category, 'category__form'),
+                                     (Activity, 'category__category__form'),
+                                     (ActivityChoice, 'activity__category__category__form')):
+                name = model._meta.model_name
+                rows = model.responsibles.through.objects.filter(
+                    **{'%s__%s' % (name, form_path): self}).values_list(
+                    '%s_id' % name, 'responsibilityperson_id')
+                for item_id, responsible_id in rows:
+                    item_key = '%s-%s' % (utils.ITEM_KEY_PREFIXES[name], item_id)
+                    item_responsibles[item_key].append(responsible_id)
+
+            responsible_ids = {pk for pks in item_responsibles.values() for pk in pks}
+            responsibles = ResponsibilityPerson.objects.filter(pk__in=responsible_ids)
+            order = {r.pk: (i, r) for i, r in enumerate(responsibles)}
+            responsible_url = url_template('view_responsible', 1)
+
+            def markup(resps: 'List[ResponsibilityPerson]', own_pk: int=None) -> str:
+                return format_html('({})', utils.safe_join(', ', (
+                    format_html('<a class="responsible-link" href="{}">{}</a>',
+                                responsible_url.format(r.pk), r)
+                    if r.pk != own_pk else conditional_escape(r)
+                    for r in resps)))
+
+            links = {}
+            for item_key, pks in item_responsibles.items():
+                resps = [r for i, r in sorted(order[pk] for pk in pks)]
+                links[item_key] = {'': markup(resps)}
+                for r in resps:
+                    links[item_key][str(r.pk)] = markup(resps, r.pk)
+            cache.set(key, links)
+        self.__dict__['_responsible_links'] = links
+        return links
+
     def bulk_email_responsibles(self) -> None:
         logger.info('Bulk email responsibles %s', self)
 
@@ -447,12 +904,19 @@ class ServiceForm(SubitemMixin, models.Model):
         logger.info('Bulk email former participants %s', self)
         for p in Participant.objects.filter(send_email_allowed=True,
                                             form_revision__send_bulk_email_to_participants=True,
-                                            form_revision__form=self,
+                                            form=self,
                                             form_revision__valid_to__lt=timezone.now(),
-                                            status__in=Participant.READY_STATUSES
-                                            ).distinct():
+                                            status__in=Participant.READY_STATUSES):
             p.send_participant_email(Participant.EmailIds.NEW_FORM_REVISION)
 
+    def shuffle_data(self) -> int:
+        logger.info('Shuffle participant data %s', self)
+
+        def progress(done: int, total: int) -> None:
+            logger.info('Shuffled %d/%d rows of %s', done, total, self)
+
+        return utils.shuffle_person_data(self, progress=progress)
+
     def reschedule_bulk_email(self) -> None:
         now = timezone.now()
         self.tasks.filter(scheduled_time__gt=now, status=Task.REQUESTED).delete()
@@ -550,25 +1014,14 @@ class Activity(SubitemMixin, NameDescriptionMixin, AbstractServiceFormItem):
 
     @property
     def has_choices(self) -> bool:
-        return self.activitychoice_set.exists()
+        return bool(self.sub_items)
 
     @property
     def id_display(self) -> str:
         return '%s+' % max(1, self._counter) if self.skip_numbering else self._counter
 
     def participation_items(self, revision_name: str) -> 'Sequence[ParticipationActivity]':
-        current_revision = self.category.category.form.current_revision
-
-        qs = self.participationactivity_set.filter(
-            participant__status__in=Participant.READY_STATUSES)
-
-        if revision_name == utils.RevisionOptions.ALL:
-            qs = qs.order_by('participant__form_revision')
-        elif revision_name == utils.RevisionOptions.CURRENT:
-            qs = qs.filter(participant__form_revision=current_revision)
-        else:
-            qs = qs.filter(participant__form_revision__name=revision_name)
-        return qs
+        return self.category.category.form.report(revision_name).participation_items(self)
 
     @property
     def show_checkbox(self) -> bool:
@@ -600,18 +1053,8 @@ class ActivityChoice(SubitemMixin, NameDescriptionMixin, AbstractServiceFormItem
         return self._counter == 0
 
     def participation_items(self, revision_name: str) -> 'Sequence[ParticipationActivityChoice]':
-        current_revision = self.activity.category.category.form.current_revision
-
-        qs = self.participationactivitychoice_set.filter(
-            activity__participant__status__in=Participant.READY_STATUSES)
-
-        if revision_name == utils.RevisionOptions.ALL:
-            qs = qs.order_by('activity__participant__form_revision')
-        elif revision_name == utils.RevisionOptions.CURRENT:
-            qs = qs.filter(activity__participant__form_revision=current_revision)
-        else:
-            qs = qs.filter(activity__participant__form_revision__name=revision_name)
-        return qs
+        form = self.activity.category.category.form
+        return form.report(revision_name).participation_items(self)
 
     @cached_property
     def background_color_display(self) -> 'ColorStr':
@@ -649,18 +1092,7 @@ class Question(CopyMixin, AbstractServiceFormItem):
             {'question': self})
 
     def questionanswers(self, revision_name: str) -> 'Sequence[QuestionAnswer]':
-        qs = QuestionAnswer.objects.filter(question=self,
-                                           participant__status__in=Participant.READY_STATUSES)
-
-        current_revision = self.form.current_revision
-
-        if revision_name == utils.RevisionOptions.ALL:
-            qs = qs.order_by('-participant__form_revision')
-        elif revision_name == utils.RevisionOptions.CURRENT:
-            qs = qs.filter(participant__form_revision=current_revision)
-        else:
-            qs = qs.filter(participant__form_revision__name=revision_name)
-        return qs
+        return self.form.question_answers(revision_name).get(self.pk, [])
 
     def __str__(self):
         return self.question
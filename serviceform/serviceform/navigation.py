@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# (c) 2017 Tuomas Airaksinen
+#
+# This file is part of Serviceform.
+#
+# Serviceform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Serviceform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import lru_cache
+from typing import NamedTuple, Tuple, Sequence
+from urllib.parse import quote
+
+from django.urls import reverse, get_script_prefix
+from django.utils.html import format_html
+from django.utils.translation import get_language
+
+# Digits match all argument patterns in url config ((\d+) and ([\w-]+))
+_ARG_SENTINEL = '73519%d82046'
+
+
+class UrlTemplate:
+    """
+    URL of a named view with placeholders for positional arguments. Compiled with one
+    reverse call, so that URLs can be formatted without resolver.
+    Arguments are not validated against url patterns like in reverse.
+    """
+    __slots__ = ('_parts',)
+
+    def __init__(self, name: str, arg_count: int) -> None:
+        url = reverse(name, args=[_ARG_SENTINEL % i for i in range(arg_count)])
+        parts = []
+        for i in range(arg_count):
+            part, url = url.split(_ARG_SENTINEL % i, 1)
+            parts.append(part)
+        parts.append(url)
+        self._parts: Tuple[str, ...] = tuple(parts)
+
+    def format(self, *args) -> str:
+        parts = self._parts
+        # Same quoting as in reverse
+        return ''.join(parts[i] + quote(str(arg), safe="!$&'()*+,;=/~:@")
+                       for i, arg in enumerate(args)) + parts[-1]
+
+
+@lru_cache(maxsize=None)
+def _url_template(name: str, arg_count: int, script_prefix: str) -> UrlTemplate:
+    return UrlTemplate(name, arg_count)
+
+
+def url_template(name: str, arg_count: int=0) -> UrlTemplate:
+    return _url_template(name, arg_count, get_script_prefix())
+
+
+class MenuEntry(NamedTuple):
+    name: str
+    title: str
+    url: str
+    is_right: bool
+
+
+@lru_cache(maxsize=1024)
+def compile_menu(menu_name: str, form_slug: str, form_id: int, responsible_logged_in: bool,
+                 access_full_report: bool, language: str,
+                 script_prefix: str) -> Sequence[MenuEntry]:
+    """
+    Menu entries of menu_name for given form and role. Titles are rendered in given
+    language. Entries do not depend on current view (see menu_items tag).
+    """
+    from .urls import menu_urls, Requires
+
+    satisfied = set()
+    if responsible_logged_in:
+        satisfied.add(Requires.RESPONSIBLE_LOGGED_IN)
+    if access_full_report:
+        satisfied.add(Requires.ACCESS_FULL_REPORT)
+    form_attrs = {'slug': form_slug, 'id': form_id}
+
+    entries = []
+    for f_item in menu_urls[menu_name]:
+        if not satisfied.issuperset(f_item.default_args.get('require', ())):
+            continue
+        arglist = f_item.default_args.get('arglist', ('slug',))
+        url = url_template(f_item.name, len(arglist)).format(*(form_attrs[i] for i in arglist))
+        title = f_item.default_args.get('title', '')
+        icon = f_item.default_args.get('icon')
+        if icon:
+            title = format_html('<span class="fa fa-{}"></span> {}', icon, title)
+        else:
+            title = str(title)
+        entries.append(MenuEntry(f_item.name, title, url, bool(f_item.default_args.get('right'))))
+    return tuple(entries)
+
+
+def menu(menu_name: str, service_form, responsible) -> Sequence[MenuEntry]:
+    return compile_menu(menu_name, service_form.slug, service_form.pk, bool(responsible),
+                        bool(responsible and responsible.show_full_report), get_language(),
+                        get_script_prefix())
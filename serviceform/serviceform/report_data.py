@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+# (c) 2017 Tuomas Airaksinen
+#
+# This file is part of Serviceform.
+#
+# Serviceform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Serviceform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from collections import defaultdict, Counter
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Union, TYPE_CHECKING
+
+from django.conf import settings
+from django.core import serializers
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import utils
+from .models import (Participant, ParticipationActivity, ParticipationActivityChoice,
+                     QuestionAnswer, ActivityChoice, ParticipantLog, ContactDetailsMixin)
+
+if TYPE_CHECKING:
+    from .models import FormRevision, ServiceForm, Activity
+    from .models.serviceform import AbstractServiceFormItem
+
+
+SNAPSHOT_FORMAT = 2
+
+
+def _snapshot_key(revision_id: int) -> str:
+    return 'report_snapshot_%s_v%s' % (revision_id, SNAPSHOT_FORMAT)
+
+
+def invalidate_snapshot(revision_id: int) -> None:
+    caches['persistent'].delete(_snapshot_key(revision_id))
+
+
+class ReportParticipant:
+    """
+    Compact read-only row of participant, with only the data shown in reports.
+    Much lighter than Participant model instance, which matters when reports
+    contain tens of thousands of participants.
+    """
+    FIELDS = ('pk', 'forenames', 'surname', 'email', 'phone_number', 'street_address',
+              'postal_code', 'city', 'year_of_birth', 'status')
+    __slots__ = FIELDS + ('form_revision', 'item_count', '_report')
+
+    def __init__(self, report: 'RevisionReport', values: Sequence) -> None:
+        for name, value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+        self.form_revision = report.revision
+        self.item_count = 0
+        self._report = report
+
+    def values(self) -> list:
+        return [getattr(self, name) for name in self.FIELDS]
+
+    # Same as ContactDetailsMixin and Participant
+    __str__ = ContactDetailsMixin.__str__
+    address = ContactDetailsMixin.address
+
+    @property
+    def age(self) -> Union[int, str]:
+        return timezone.now().year - self.year_of_birth if self.year_of_birth else '-'
+
+    @property
+    def log(self) -> 'Sequence[ParticipantLog]':
+        return self._report.logs.get(self.pk, ())
+
+
+class RevisionReport:
+    """
+    Ready participants of one form revision together with their participations and
+    question answers, indexed by pk of the form item they refer to.
+
+    Reports of closed revisions (valid_to passed and nobody updating their participation)
+    do not change any more, so they are stored as snapshots in persistent cache.
+    Snapshot is invalidated when participant of the revision is saved or deleted,
+    when revision itself is changed, and when form structure version changes.
+    """
+
+    def __init__(self, revision: 'FormRevision', participant_rows: Sequence[Sequence],
+                 participation_activities: List[ParticipationActivity],
+                 participation_choices: List[ParticipationActivityChoice],
+                 question_answers: List[QuestionAnswer]) -> None:
+        self.revision = revision
+        self._rows = (participation_activities, participation_choices, question_answers)
+        participants = [ReportParticipant(self, values) for values in participant_rows]
+        self.participants: Dict[int, ReportParticipant] = {p.pk: p for p in participants}
+        self.activities: Dict[int, List[ParticipationActivity]] = defaultdict(list)
+        self.choices: Dict[int, List[ParticipationActivityChoice]] = defaultdict(list)
+        self.answers: Dict[int, List[QuestionAnswer]] = defaultdict(list)
+
+        activities = {}
+        for pa in participation_activities:
+            pa.__dict__['cached_participant'] = self.participants[pa.participant_id]
+            activities[pa.pk] = pa
+            self.activities[pa.activity_id].append(pa)
+
+        # Item count: activities without choices + choices
+        item_counts = Counter()
+        activities_with_choices = set()
+        for pc in participation_choices:
+            pc.activity = pa = activities[pc.activity_id]
+            pc.__dict__['cached_participant'] = pa.cached_participant
+            self.choices[pc.activity_choice_id].append(pc)
+            activities_with_choices.add(pa.pk)
+            item_counts[pa.participant_id] += 1
+        for pa in participation_activities:
+            if pa.pk not in activities_with_choices:
+                item_counts[pa.participant_id] += 1
+        for p in participants:
+            p.item_count = item_counts[p.pk]
+
+        for qa in question_answers:
+            qa.__dict__['cached_participant'] = self.participants[qa.participant_id]
+            self.answers[qa.question_id].append(qa)
+
+    @property
+    def is_final(self) -> bool:
+        return self.revision.is_closed and not any(
+            p.status == Participant.STATUS_UPDATING for p in self.participants.values())
+
+    @classmethod
+    def load(cls, revision: 'FormRevision') -> 'RevisionReport':
+        ready = Participant.READY_STATUSES
+        return cls(
+            revision,
+            Participant.objects.filter(form_revision=revision, status__in=ready)
+            .order_by('pk').values_list(*ReportParticipant.FIELDS),
+            list(ParticipationActivity.objects.filter(
+                participant__form_revision=revision,
+                participant__status__in=ready).order_by('pk')),
+            list(ParticipationActivityChoice.objects.filter(
+                activity__participant__form_revision=revision,
+                activity__participant__status__in=ready).order_by('pk')),
+            list(QuestionAnswer.objects.filter(
+                participant__form_revision=revision,
+                participant__status__in=ready).order_by('pk')),
+        )
+
+    @cached_property
+    def logs(self) -> 'Dict[int, List[ParticipantLog]]':
+        """
+        Logs of participants by participant pk. Loaded when first shown, and always
+        from database (they are not part of snapshots).
+        """
+        logs = defaultdict(list)
+        for log in ParticipantLog.objects.filter(
+                participant__form_revision=self.revision,
+                participant__status__in=Participant.READY_STATUSES).order_by('pk')\
+                .prefetch_related('written_by'):
+            logs[log.participant_id].append(log)
+        return logs
+
+    def dumps(self) -> str:
+        return json.dumps([[p.values() for p in self.participants.values()],
+                           serializers.serialize('json', chain.from_iterable(self._rows))],
+                          cls=DjangoJSONEncoder)
+
+    @classmethod
+    def loads(cls, revision: 'FormRevision', data: str) -> 'RevisionReport':
+        participant_rows, serialized = json.loads(data)
+        rows = defaultdict(list)
+        for deserialized in serializers.deserialize('json', serialized):
+            rows[type(deserialized.object)].append(deserialized.object)
+        return cls(revision, participant_rows, rows[ParticipationActivity],
+                   rows[ParticipationActivityChoice], rows[QuestionAnswer])
+
+    @classmethod
+    def for_revision(cls, revision: 'FormRevision') -> 'RevisionReport':
+        if not revision.is_closed:
+            return cls.load(revision)
+
+        cache = caches['persistent']
+        key = _snapshot_key(revision.pk)
+        structure_version = utils.form_structure_version(revision.form_id)
+        snapshot = cache.get(key)
+        if snapshot and snapshot[0] == structure_version:
+            return cls.loads(revision, snapshot[1])
+
+        report = cls.load(revision)
+        if report.is_final:
+            cache.set(key, [structure_version, report.dumps()])
+        return report
+
+
+class FormReport:
+    """
+    Report data of revisions selected in report settings (a single revision
+    or all revisions), combined from RevisionReports.
+    """
+
+    def __init__(self, service_form: 'ServiceForm',
+                 revision_reports: Sequence[RevisionReport]) -> None:
+        self.service_form = service_form
+        self.participants: Dict[int, ReportParticipant] = {}
+        self.activities: Dict[int, List[ParticipationActivity]] = defaultdict(list)
+        self.choices: Dict[int, List[ParticipationActivityChoice]] = defaultdict(list)
+        for report in revision_reports:
+            self.participants.update(report.participants)
+            for activity_id, items in report.activities.items():
+                self.activities[activity_id].extend(items)
+            for choice_id, items in report.choices.items():
+                self.choices[choice_id].extend(items)
+        self._revision_reports = revision_reports
+
+    @classmethod
+    def load(cls, service_form: 'ServiceForm', revision_name: str) -> 'FormReport':
+        revisions = service_form.revisions(revision_name).order_by('pk')
+        return cls(service_form, [RevisionReport.for_revision(r) for r in revisions])
+
+    def participation_items(self, item: 'Union[Activity, ActivityChoice]') \
+            -> 'Sequence[Union[ParticipationActivity, ParticipationActivityChoice]]':
+        index = self.choices if isinstance(item, ActivityChoice) else self.activities
+        return index.get(item.pk, [])
+
+    @cached_property
+    def question_answers(self) -> Dict[int, List[QuestionAnswer]]:
+        # Newest revision first
+        questions = {q.pk: q for q in self.service_form.questions}
+        answers = defaultdict(list)
+        for report in reversed(self._revision_reports):
+            for question_id, items in report.answers.items():
+                for answer in items:
+                    answer.question = questions[question_id]
+                answers[question_id].extend(items)
+        return dict(answers)
+
+
+REPORT_API_VERSION = 1
+
+
+def _columns(*names: str) -> Dict[str, list]:
+    return {name: [] for name in names}
+
+
+def _append(table: Dict[str, list], *values) -> None:
+    for column, value in zip(table.values(), values):
+        column.append(value)
+
+
+def report_json(service_form: 'ServiceForm', revision_name: str) -> str:
+    """
+    Report of given revision(s) as compact columnar JSON, to be rendered in browser:
+
+     - structure: form items (level 1 and 2 categories, activities, choices and questions),
+       parent refers to row index in this table, responsibles to responsible ids
+     - responsibles, participants: one row per person
+     - activities, choices, answers: participation edges from item id to participant id
+
+    Each table is an object of equally long column arrays. Cached until form structure
+    or participation data changes.
+    """
+    cache = caches['default']
+    key = 'report_json_%s_%s_%s_%s' % (service_form.pk,
+                                       utils.form_structure_version(service_form.pk),
+                                       utils.participation_watermark(service_form.pk),
+                                       revision_name)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    service_form.init_counters()
+    report = service_form.report(revision_name)
+
+    structure = _columns('id', 'type', 'parent', 'number', 'name', 'people_needed',
+                         'responsibles')
+
+    def add_item(item: 'AbstractServiceFormItem', item_type: str, parent: Optional[int]) -> int:
+        _append(structure, item.pk, item_type, parent, getattr(item, 'id_display', ''),
+                item.name, getattr(item, 'people_needed', 0),
+                [r.pk for r in item.responsibles.all()])
+        return len(structure['id']) - 1
+
+    for c1 in service_form.sub_items:
+        c1_row = add_item(c1, 'category1', None)
+        for c2 in c1.sub_items:
+            c2_row = add_item(c2, 'category2', c1_row)
+            for activity in c2.sub_items:
+                activity_row = add_item(activity, 'activity', c2_row)
+                for choice in activity.sub_items:
+                    add_item(choice, 'choice', activity_row)
+    for question in service_form.questions.prefetch_related('responsibles'):
+        _append(structure, question.pk, 'question', None, '', question.question, 0,
+                [r.pk for r in question.responsibles.all()])
+
+    responsibles = _columns('id', 'name', 'email', 'phone')
+    for r in service_form.responsibilityperson_set.all():
+        _append(responsibles, r.pk, str(r), r.email, r.phone_number)
+
+    participants = _columns('id', 'name', 'email', 'phone', 'address', 'age', 'revision',
+                            'item_count')
+    for p in sorted(report.participants.values(), key=lambda p: p.surname):
+        _append(participants, p.pk, str(p), p.email, p.phone_number, p.address,
+                p.year_of_birth and p.age, p.form_revision.name, p.item_count)
+
+    activities = _columns('id', 'participant', 'info')
+    for activity_id, items in report.activities.items():
+        for pa in items:
+            _append(activities, activity_id, pa.participant_id, pa.additional_info)
+    choices = _columns('id', 'participant', 'info')
+    for choice_id, items in report.choices.items():
+        for pc in items:
+            _append(choices, choice_id, pc.activity.participant_id, pc.additional_info)
+    answers = _columns('id', 'participant', 'answer')
+    for question_id, items in report.question_answers.items():
+        for qa in items:
+            _append(answers, question_id, qa.participant_id, qa.answer)
+
+    data = json.dumps({'version': REPORT_API_VERSION,
+                       'form': service_form.slug,
+                       'revision': revision_name,
+                       'structure': structure,
+                       'responsibles': responsibles,
+                       'participants': participants,
+                       'activities': activities,
+                       'choices': choices,
+                       'answers': answers},
+                      cls=DjangoJSONEncoder, separators=(',', ':'))
+    cache.set(key, data, getattr(settings, 'REPORT_JSON_CACHE_TIMEOUT', 60*60))
+    return data
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# (c) 2017 Tuomas Airaksinen
+#
+# This file is part of Serviceform.
+#
+# Serviceform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Serviceform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from guardian.utils import get_user_obj_perms_model, get_group_obj_perms_model
+
+from . import models, utils, report_data
+
+
+def _form_id(instance) -> Optional[int]:
+    # Parent objects may be already deleted (cascading delete), thus values_list queries
+    if isinstance(instance, models.ServiceForm):
+        return instance.pk
+    if isinstance(instance, (models.Level1Category, models.Question)):
+        return instance.form_id
+    if isinstance(instance, models.Level2Category):
+        return models.Level1Category.objects.filter(
+            pk=instance.category_id).values_list('form_id', flat=True).first()
+    if isinstance(instance, models.Activity):
+        return models.Level2Category.objects.filter(
+            pk=instance.category_id).values_list('category__form_id', flat=True).first()
+    if isinstance(instance, models.ActivityChoice):
+        return models.Activity.objects.filter(
+            pk=instance.activity_id).values_list('category__category__form_id', flat=True).first()
+
+
+structure_models = (models.ServiceForm, models.Level1Category, models.Level2Category,
+                    models.Activity, models.ActivityChoice, models.Question)
+
+
+def form_structure_changed(sender, instance, **kwargs) -> None:
+    form_id = _form_id(instance)
+    if form_id:
+        utils.bump_form_structure_version(form_id)
+
+
+for model in structure_models:
+    post_save.connect(form_structure_changed, sender=model)
+    post_delete.connect(form_structure_changed, sender=model)
+
+
+def item_responsibles_changed(sender, instance, action: str, **kwargs) -> None:
+    # Instance is either form item or responsible (reverse relation)
+    if action.startswith('post_'):
+        form_id = (instance.form_id if isinstance(instance, models.ResponsibilityPerson)
+                   else _form_id(instance))
+        if form_id:
+            utils.bump_form_structure_version(form_id)
+
+
+for model in (models.Level1Category, models.Level2Category, models.Activity,
+              models.ActivityChoice):
+    m2m_changed.connect(item_responsibles_changed, sender=model.responsibles.through)
+
+
+def participants_changed(sender, instance, raw: bool=False, **kwargs) -> None:
+    revision_ids = {instance.form_revision_id, getattr(instance, '_loaded_form_revision_id', None)}
+    for revision_id in revision_ids - {None}:
+        report_data.invalidate_snapshot(revision_id)
+    instance._loaded_form_revision_id = instance.form_revision_id
+    if not raw:  # related objects may not exist yet when loading fixtures
+        instance.participation_changed()
+
+
+def participant_log_changed(sender, instance, raw: bool=False, **kwargs) -> None:
+    if raw:
+        return
+    participant = models.Participant.objects.filter(pk=instance.participant_id).first()
+    if participant:
+        participant.participation_changed()
+
+
+RESPONSIBLE_LINK_FIELDS = {'forenames', 'surname', 'email'}
+
+
+def responsible_changed(sender, instance, update_fields=None, **kwargs) -> None:
+    # Responsibles are shown in reports
+    utils.bump_participation_watermark(instance.form_id)
+    # Names are part of precomputed responsible links (ServiceForm.responsible_links).
+    # Saving only auth keys (on every login) does not change them.
+    if update_fields is None or RESPONSIBLE_LINK_FIELDS & set(update_fields):
+        utils.bump_form_structure_version(instance.form_id)
+
+
+def revision_changed(sender, instance, **kwargs) -> None:
+    report_data.invalidate_snapshot(instance.pk)
+    utils.bump_participation_watermark(instance.form_id)
+
+
+post_save.connect(participants_changed, sender=models.Participant)
+post_delete.connect(participants_changed, sender=models.Participant)
+post_save.connect(revision_changed, sender=models.FormRevision)
+post_delete.connect(revision_changed, sender=models.FormRevision)
+post_save.connect(participant_log_changed, sender=models.ParticipantLog)
+post_delete.connect(participant_log_changed, sender=models.ParticipantLog)
+post_save.connect(responsible_changed, sender=models.ResponsibilityPerson)
+post_delete.connect(responsible_changed, sender=models.ResponsibilityPerson)
+
+
+def permissions_changed(sender, **kwargs) -> None:
+    # Note: guardian's assign_perm for querysets uses bulk_create, which sends no signals
+    utils.bump_permission_version()
+
+
+for model in (get_user_obj_perms_model(models.ServiceForm),
+              get_group_obj_perms_model(models.ServiceForm)):
+    post_save.connect(permissions_changed, sender=model)
+    post_delete.connect(permissions_changed, sender=model)
+m2m_changed.connect(permissions_changed, sender=get_user_model().groups.through)
@@ -40,6 +40,28 @@ $(document).ready(function () {
         $(".extra-" + this.name).prop('disabled', !this.checked);
     });
 
+    // autosave single changes of participation form
+
+    var participation_form = $('#participationform');
+    var autosave_url = participation_form.data('autosave-url');
+    if(autosave_url) {
+        var autosave = function (data) {
+            data.csrfmiddlewaretoken = participation_form.find('input[name=csrfmiddlewaretoken]').val();
+            $.post(autosave_url, data).done(function () {
+                participation_form.trigger('reinitialize.areYouSure');
+            });
+        };
+        participation_form.on('change', '.activity-input, .choice-input', function () {
+            autosave({name: this.name, checked: this.checked});
+        });
+        participation_form.on('change', '.choice-radio-input', function () {
+            autosave({name: this.name, value: this.value, checked: true});
+        });
+        participation_form.on('change', 'textarea', function () {
+            autosave({name: this.name, value: this.value});
+        });
+    }
+
     // report
 
     $("#show-old").change(function () {
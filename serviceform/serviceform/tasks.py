@@ -45,5 +45,12 @@ def finish_abandoned_updating_participations():
         p.finish(from_user=False)
 
 
+@shared_task
+def update_participation_counts():
+    for s in models.ServiceForm.objects.select_related('current_revision'):
+        if s.is_published:
+            s.participation_counts(refresh=True)
+
+
 def test_task():
     raise Exception
\ No newline at end of file
@@ -1,17 +1,20 @@
-from typing import NamedTuple, Dict, List, TYPE_CHECKING, Union, Iterable, Sequence
+from typing import NamedTuple, Dict, List, TYPE_CHECKING, Union, Iterable, Sequence, Optional
 
 from django import template
-from django.urls import reverse
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
 from django.template import Context
-from django.utils.html import format_html
+from django.utils.html import format_html, conditional_escape
 from django.utils.safestring import mark_safe, SafeString
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, get_language
 import os
 
 from ..models import Participant
-from ..utils import safe_join, ColorStr
-from .. import utils
-from ..urls import participant_flow_urls, menu_urls, Requires
+from ..utils import ColorStr
+from .. import utils, navigation
+from ..navigation import url_template
+from ..urls import participant_flow_urls
 from ..utils import lighter_color as lighter_color_util, darker_color
 
 register = template.Library()
@@ -47,18 +50,27 @@ def responsible_link(context: Context, item: 'AbstractServiceFormItem') -> SafeS
     Used in category captions in report views, for example
     """
     responsible = context.get('responsible')
-    item_responsibles = item.responsibles.all()
+    service_form = context.get('service_form')
+    if service_form is None:
+        return _responsible_link_markup(item, responsible)
+    links = service_form.responsible_links().get(utils.item_key(item))
+    if not links:
+        return ''
+    return mark_safe(links.get(str(responsible.pk) if responsible else '', links['']))
+
+
+def _responsible_link_markup(item: 'AbstractServiceFormItem',
+                             responsible: 'Optional[ResponsibilityPerson]') -> SafeString:
+    responsible_url = url_template('view_responsible', 1)
     links = []
-    for item_responsible in item_responsibles:
+    for item_responsible in item.responsibles.all():
         if responsible != item_responsible:
             links.append(format_html('<a class="responsible-link" href="{}">{}</a>',
-                                     reverse('view_responsible', args=(item_responsible.pk,)),
+                                     responsible_url.format(item_responsible.pk),
                                      item_responsible))
         else:
-            links.append(mark_safe(responsible))
-
-    rv = format_html('({})', safe_join(', ', links)) if links else ''
-    return rv
+            links.append(conditional_escape(item_responsible))
+    return format_html('({})', utils.safe_join(', ', links)) if links else ''
 
 
 @register.simple_tag()
@@ -78,7 +90,7 @@ def has_responsible(item: 'SubitemMixin', responsible: 'ResponsibilityPerson') -
 def participation_items(context: Context, item: 'Union[Activity, ActivityChoice]')\
         -> 'Sequence[ParticipationActivity, ParticipationActivityChoice]':
     revision_name = utils.get_report_settings(context['request'], 'revision')
-    return item.participation_items(revision_name)
+    return context['service_form'].report(revision_name).participation_items(item)
 
 
 @register.simple_tag(takes_context=True)
@@ -98,37 +110,79 @@ def participants(context: Context) -> 'Sequence[Participant]':
     revision_name = utils.get_report_settings(context['request'], 'revision')
     service_form = context.get('service_form')
 
-    qs = Participant.objects.filter(form_revision__form=service_form,
-                                    status__in=Participant.READY_STATUSES).order_by('surname')
-    if revision_name == utils.RevisionOptions.CURRENT:
-        qs = qs.filter(form_revision__id=service_form.current_revision_id)
-    elif revision_name == utils.RevisionOptions.ALL:
-        pass
-    else:
-        qs = qs.filter(form_revision__name=revision_name)
+    qs = service_form.ready_participants(revision_name).order_by('surname')
     return [utils.get_participant(i) for i, in qs.values_list('pk')]
 
 
+def report_cache_key(context: Context) -> str:
+    """
+    Common part of keys of cached report fragments. Changes whenever form structure or
+    participation data changes, and varies by revision selection, language and
+    responsible person viewing the report. Computed once per request.
+    """
+    request = context['request']
+    key = getattr(request, '_report_cache_key', None)
+    if key is None:
+        service_form = context['service_form']
+        responsible = context.get('responsible')
+        key = request._report_cache_key = '%s_%s_%s_%s_%s_%s' % (
+            service_form.pk, utils.form_structure_version(service_form.pk),
+            utils.participation_watermark(service_form.pk),
+            utils.get_report_settings(request, 'revision'), get_language(),
+            responsible.pk if responsible else '')
+    return key
+
+
+class ReportFragmentNode(template.Node):
+    def __init__(self, nodelist: template.NodeList, vary_on: List[template.base.FilterExpression]):
+        self.nodelist = nodelist
+        self.vary_on = vary_on
+
+    def render(self, context: Context) -> str:
+        cache = caches['default']
+        key = make_template_fragment_key(
+            'report', [report_cache_key(context)] + [v.resolve(context) for v in self.vary_on])
+        value = cache.get(key)
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(key, value, getattr(settings, 'REPORT_FRAGMENT_CACHE_TIMEOUT', 60*60))
+        return value
+
+
+@register.tag
+def report_fragment(parser: template.base.Parser,
+                    token: template.base.Token) -> ReportFragmentNode:
+    """
+    Cache report fragment until form structure or participations change. Usage::
+
+        {% report_fragment 'activities' c1.pk %} ... {% endreport_fragment %}
+    """
+    nodelist = parser.parse(('endreport_fragment',))
+    parser.delete_first_token()
+    vary_on = [parser.compile_filter(bit) for bit in token.split_contents()[1:]]
+    return ReportFragmentNode(nodelist, vary_on)
+
+
 @register.simple_tag(takes_context=True)
 def participant_flow_menu_items(context: Context) -> List[FlowItem]:
     current_view = context['request'].resolver_match.view_name
-    participant = context['request'].participant
+    flow = context['request'].participant.flow_state
     cat_num = context.get('cat_num', 0)
     lst = []
 
     for idx, f_item in enumerate(participant_flow_urls):
-        if f_item.name not in participant.flow:
+        if f_item.name not in flow:
             continue
         if current_view == f_item.name:
             attrs = {'current': True, 'disabled': True}
-        elif not participant.can_access_view(f_item.name):
+        elif not flow.can_access(f_item.name):
             attrs = {'greyed': True, 'disabled': True}
         else:
             attrs = {}
         if f_item.name == 'participation':
-            url = reverse(f_item.name, args=(cat_num,))
+            url = url_template(f_item.name, 1).format(cat_num)
         else:
-            url = reverse(f_item.name)
+            url = url_template(f_item.name).format()
         flv = FlowItem(f_item.name, f_item.default_args.get('title', ''), url, attrs)
         lst.append(flv)
     return lst
@@ -140,8 +194,9 @@ def participant_flow_categories(context: Context) -> List[FlowItem]:
     service_form = context['service_form']
     cat_num = context.get('cat_num', 0)
     max_cat = context.get('max_cat', 0)
+    participation_url = url_template(current_view, 1)
     lst = []
-    for idx, category in enumerate(service_form.sub_items):
+    for idx, category in enumerate(service_form.level1_categories):
         if idx == cat_num:
             attrs = {'current': True, 'disabled': True}
         elif idx > max_cat:
@@ -149,7 +204,7 @@ def participant_flow_categories(context: Context) -> List[FlowItem]:
         else:
             attrs = {}
         attrs['category'] = category
-        url = reverse(current_view, args=(idx,))
+        url = participation_url.format(idx)
         flv = FlowItem(idx, category.name, url, attrs)
         lst.append(flv)
     return lst
@@ -163,38 +218,13 @@ def menu_items(context: Context, menu_name: str) -> MenuItems:
      - Participation password_login page menu
     """
     current_view = context['request'].resolver_match.view_name
-    service_form = context['service_form']
     responsible = utils.get_responsible(context['request'])
 
-    def _check_requires(requires):
-        for r in requires:
-            if r == Requires.ACCESS_FULL_REPORT:
-                if not (responsible and responsible.show_full_report):
-                    return False
-            if r == Requires.RESPONSIBLE_LOGGED_IN:
-                if not responsible:
-                    return False
-        return True
-
     left = []
     right = []
-    for idx, f_item in enumerate(menu_urls[menu_name]):
-        name = f_item.name
-        is_active = current_view == name
-        arglist = f_item.default_args.get('arglist', ('slug',))
-        requires = f_item.default_args.get('require', [])
-        if not _check_requires(requires):
-            continue
-
-        args = tuple(getattr(service_form, i) for i in arglist)
-        url = reverse(name, args=args)
-        is_right = f_item.default_args.get('right')
-        title = f_item.default_args.get('title', '')
-        icon = f_item.default_args.get('icon')
-        if icon:
-            title = format_html('<span class="fa fa-{}"></span> {}', icon, title)
-        itm = MenuItem(name, title, url, is_active)
-        if is_right:
+    for entry in navigation.menu(menu_name, context['service_form'], responsible):
+        itm = MenuItem(entry.name, entry.title, entry.url, current_view == entry.name)
+        if entry.is_right:
             right.append(itm)
         else:
             left.append(itm)
@@ -239,6 +269,26 @@ def color_style(item: 'AbstractServiceFormItem', lighter=0, attr='background') -
         return format_html('')
 
 
+@register.simple_tag(takes_context=True)
+def color_class(context: Context, item: 'AbstractServiceFormItem', lighter: int=0) -> str:
+    """
+    CSS class of item background color, defined in form palette stylesheet
+    (see form_palette_link). Empty if item has no color.
+    """
+    service_form = context.get('service_form')
+    cls = utils.palette_class(item, lighter)
+    return cls if service_form and cls in service_form.palette() else ''
+
+
+@register.simple_tag(takes_context=True)
+def form_palette_link(context: Context) -> SafeString:
+    service_form = context.get('service_form')
+    if not service_form:
+        return format_html('')
+    return format_html('<link href="{}" type="text/css" rel="stylesheet">',
+                       service_form.palette_url)
+
+
 @register.filter()
 def translate_bool(value: bool) -> str:
     _('True')
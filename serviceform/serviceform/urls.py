@@ -91,6 +91,8 @@ report_urls = [
         kwargs={'title': _('Participations')}),
     url(r'^report/([\w-]+)/all_questions/$', reports_views.all_questions, name='all_questions',
         kwargs={'title': _('Answers')}),
+    url(r'^report/([\w-]+)/statistics/$', reports_views.statistics, name='statistics',
+        kwargs={'title': _('Statistics')}),
     DummyUrl(name='responsible_report',
              kwargs={'title': _('My report'), 'arglist': (), 'icon': 'bullseye',
                      'require': (Requires.RESPONSIBLE_LOGGED_IN,)}),
@@ -176,6 +178,8 @@ urlpatterns = [u for u in
                       name='view_user'),
                   url(r'^report/participant/(\d+)/generate_new_auth_link$', reports_views.participant_generate_new_auth_link,
                       name='generate_new_auth_link'),
+                  url(r'^report/([\w-]+)/api/v1/report.json$', reports_views.report_json,
+                      name='report_json'),
                   url(r'^report/responsible/(\d+)/$', reports_views.view_responsible,
                       name='view_responsible'),
 
@@ -183,12 +187,16 @@ urlpatterns = [u for u in
                   url(r'^preview/([\w-]+)/$', reports_views.preview_form, name='preview_form'),
                   url(r'^preview_printable/([\w-]+)/$', reports_views.preview_printable,
                       name='preview_printable'),
+                  url(r'^palette/([\w-]+)/([\w-]+)\.css$', reports_views.form_palette,
+                      name='form_palette'),
 
                   url(r'^logout/$', reports_views.logout_view, name='logout'),
                   url(r'^send_auth_link/(.*)$', participation_views.send_auth_link,
                       name='send_auth_link'),
                   url(r'^participant/delete/$', participation_views.delete_participation,
                       name='delete_participation'),
+                  url(r'^participant/participation/autosave/$',
+                      participation_views.participation_autosave, name='participation_autosave'),
                   url(r'^([\w-]+)/$', login_views.password_login, name='password_login'),
                   url(r'^participant/participation/$', participation_views.participation,
                       name='participation', kwargs={'cat_num': 0}),
@@ -17,23 +17,29 @@
 # along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import hashlib
+import os
 import re
 import signal
 import uuid
 import random
 import string
 import logging
-from itertools import chain
-from typing import Match, Optional, TYPE_CHECKING, Iterable, Union
+from typing import (Match, Optional, TYPE_CHECKING, Iterable, Iterator, Union, Sequence, Callable,
+                    FrozenSet)
 
 if TYPE_CHECKING:
+    from typing import Type
+    from django.db.models import Model
     from .models import ServiceForm, Participant, ResponsibilityPerson
-    from .models.serviceform import AbstractServiceFormItem
+    from .models.serviceform import AbstractServiceFormItem, Level1Category
+    from .report_data import ReportParticipant
 
 from colorful.forms import RGB_REGEX
 from django.contrib import messages
 from django.core.cache import caches
 from django.http import HttpRequest, HttpResponse
+from django.utils.http import quote_etag
 from django.shortcuts import redirect
 from django.utils.safestring import mark_safe
 
@@ -46,6 +52,7 @@ from django.utils import translation
 from django.conf import settings
 
 from django.db import transaction
+from django.db.models import Case, When, Value
 
 logger = logging.getLogger(__name__)
 
@@ -103,9 +110,74 @@ def set_report_settings(request: HttpRequest, report_settings: dict) -> None:
     cache.set('settings_for_%s' % _get_ident(request), report_settings)
 
 
+def report_etag(request: HttpRequest, service_form: 'ServiceForm') -> Optional[str]:
+    """
+    Validator for report pages. Changes whenever form structure or data shown in reports
+    changes, or viewer, report settings, language, CSRF token or software version changes.
+    Cheap to compute: only cache lookups. None if page must be rendered anyway
+    (there are messages to show).
+    """
+    if messages.get_messages(request):
+        return None
+    import serviceform
+    validator = '|'.join(str(i) for i in (
+        serviceform.__version__, os.getenv('VCS_REF', ''),
+        service_form.pk, form_structure_version(service_form.pk),
+        participation_watermark(service_form.pk),
+        get_report_settings(request, 'revision'), translation.get_language(),
+        request.user.pk, request.session.get('authenticated_responsibility'),
+        request.META.get('CSRF_COOKIE', '')))
+    return quote_etag(hashlib.md5(validator.encode()).hexdigest())
+
+
+def permission_version() -> str:
+    """
+    Version token of object permissions, changed by signal handlers (see signals.py)
+    whenever guardian permissions or group memberships change.
+    """
+    return caches['persistent'].get_or_set('permission_version', generate_uuid)
+
+
+def bump_permission_version() -> None:
+    caches['persistent'].set('permission_version', generate_uuid())
+
+
+def accessible_form_ids(user: settings.AUTH_USER_MODEL) -> 'FrozenSet[int]':
+    """
+    Ids of service forms that user has can_access_serviceform object permission to, directly
+    or via groups. Loaded with one query, memoized per user object (i.e. per request) and
+    cached for PERMISSION_CACHE_TIMEOUT seconds.
+    """
+    if not user.is_authenticated or not user.is_active:
+        return frozenset()
+    form_ids = getattr(user, '_accessible_form_ids', None)
+    if form_ids is not None:
+        return form_ids
+
+    cache = caches['default']
+    key = 'accessible_forms_%s_%s' % (user.pk, permission_version())
+    ids = cache.get(key)
+    if ids is None:
+        from guardian.utils import get_user_obj_perms_model, get_group_obj_perms_model
+        from django.contrib.contenttypes.models import ContentType
+        from .models import ServiceForm
+        perm_filter = dict(content_type=ContentType.objects.get_for_model(ServiceForm),
+                           permission__codename='can_access_serviceform')
+        user_perms = get_user_obj_perms_model(ServiceForm).objects.filter(
+            user=user, **perm_filter).values_list('object_pk')
+        group_perms = get_group_obj_perms_model(ServiceForm).objects.filter(
+            group__user=user, **perm_filter).values_list('object_pk')
+        ids = sorted({int(pk) for pk, in user_perms.union(group_perms)})
+        cache.set(key, ids, getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 60))
+    user._accessible_form_ids = frozenset(ids)
+    return user._accessible_form_ids
+
+
 def user_has_serviceform_permission(user: settings.AUTH_USER_MODEL, service_form: 'ServiceForm',
                                     raise_permissiondenied: bool=True):
-    if user.has_perm('serviceform.can_access_serviceform', service_form):
+    # Same rules as user.has_perm('serviceform.can_access_serviceform', service_form)
+    # with guardian backend, without querying permission tables on every call.
+    if user.is_active and (user.is_superuser or service_form.pk in accessible_form_ids(user)):
         return True
     else:
         if raise_permissiondenied:
@@ -115,9 +187,14 @@ def user_has_serviceform_permission(user: settings.AUTH_USER_MODEL, service_form
 
 
 _participants = {}
+_participants_loader = None
 
 
-def get_participant(_id: int) -> 'Participant':
+def get_participant(_id: int) -> 'ReportParticipant':
+    global _participants_loader
+    if _participants_loader:
+        load, _participants_loader = _participants_loader, None
+        load()
     p = _participants.get(_id)
     if p is None:
         logger.error('Participant %d was not in cache!', _id)
@@ -125,22 +202,19 @@ def get_participant(_id: int) -> 'Participant':
 
 
 def fetch_participants(service_form: 'ServiceForm', revision_name: str) -> None:
-    global _participants
-    from .models import Participant
-    is_all_revisions = revision_name == RevisionOptions.ALL
-    is_current_revision = revision_name == RevisionOptions.CURRENT
-
-    qs = Participant.objects.prefetch_related('participantlog_set__written_by')
-    if is_all_revisions:
-        qs = qs.select_related('form_revision')
-        participants = qs.filter(form_revision__form=service_form).distinct()
-    elif is_current_revision:
-        participants = qs.filter(form_revision=service_form.current_revision)
-    else:
-        participants = qs.filter(form_revision__name=revision_name)
+    """
+    Make ready participants of report available via get_participant.
+    Participants are loaded lazily, i.e. not at all if report is rendered from cached fragments,
+    and so are their logs (see report_data.ReportParticipant).
+    """
+    global _participants, _participants_loader
 
-    _participants = {itm.pk: itm for itm in participants}
-    return
+    def load():
+        global _participants
+        _participants = service_form.report(revision_name).participants
+
+    _participants = {}
+    _participants_loader = load
 
 
 class ClearParticipantCacheMiddleware:
@@ -181,6 +255,60 @@ class InvalidateCachalotAfterEachRequestMiddleware(object):
 _responsible_counts = defaultdict(int)
 
 
+def _add_responsible(responsibles: 'Iterable[ResponsibilityPerson]',
+                     *targets: 'AbstractServiceFormItem',
+                     resp_count: bool=False) -> None:
+    if resp_count:
+        for r in {resp for target in targets for resp in target.responsibles.all() if resp}:
+            _responsible_counts[r.pk] += 1
+    for resp in responsibles:
+        for t in targets:
+            t._responsibles.add(resp)
+
+
+def init_category_counters(cat1: 'Level1Category', cat1_counter: int, activity_count: int,
+                           all_responsibles: bool=True, resp_count: bool=True) -> int:
+    """
+    Initializes counters and collects responsibles from subitems of single level 1 category.
+
+    :param cat1_counter: counter of this category
+    :param activity_count: number of numbered activities in preceding categories
+    :param resp_count: update counts of count_for_responsible
+    :return: number of numbered activities including this category
+    """
+    cat2_counter = 0
+    cat1._counter = cat1_counter
+    cat1._responsibles = set(cat1.responsibles.all())
+    for cat2 in cat1.sub_items:
+        cat2._counter = cat2_counter
+        cat2_counter += 1
+        _add_responsible(cat2.responsibles.all(), cat1, cat2)
+        if all_responsibles:
+            cat2._responsibles.update(set(cat1.responsibles.all()))
+        for activity in cat2.sub_items:
+            if not activity.skip_numbering:
+                activity_count += 1
+            activity._counter = activity_count
+
+            choice_counter = 0
+            _add_responsible(activity.responsibles.all(), cat1, cat2, activity,
+                             resp_count=resp_count)
+            if all_responsibles:
+                activity._responsibles.update(
+                    set(cat1.responsibles.all()) | set(cat2.responsibles.all()))
+            for choice in activity.sub_items:
+                if not choice.skip_numbering:
+                    choice_counter += 1
+                choice._counter = choice_counter
+                _add_responsible(choice.responsibles.all(), cat1, cat2, activity, choice,
+                                 resp_count=resp_count)
+                if all_responsibles:
+                    choice._responsibles.update(set(activity.responsibles.all()) |
+                                                set(cat1.responsibles.all()) |
+                                                set(cat2.responsibles.all()))
+    return activity_count
+
+
 def init_serviceform_counters(service_form: 'ServiceForm', all_responsibles: bool=True) -> None:
     """
     Initializes counters and collects responsibles from subitems
@@ -188,118 +316,129 @@ def init_serviceform_counters(service_form: 'ServiceForm', all_responsibles: boo
     :return:
     """
     activity_count = 0
-    cat1_counter = 0
     _responsible_counts.clear()
 
-    def _add_responsible(responsibles: 'Iterable[ResponsibilityPerson]',
-                         *targets: 'AbstractServiceFormItem',
-                         resp_count: bool=False) -> None:
-        if resp_count:
-            for r in {resp for target in targets for resp in target.responsibles.all() if resp}:
-                _responsible_counts[r.pk] += 1
-        for resp in responsibles:
-            for t in targets:
-                t._responsibles.add(resp)
-
-    for cat1 in service_form.sub_items:
-        cat2_counter = 0
-        cat1._counter = cat1_counter
-        cat1_counter += 1
-        cat1._responsibles = set(cat1.responsibles.all())
-        for cat2 in cat1.sub_items:
-            cat2._counter = cat2_counter
-            cat2_counter += 1
-            _add_responsible(cat2.responsibles.all(), cat1, cat2)
-            if all_responsibles:
-                cat2._responsibles.update(set(cat1.responsibles.all()))
-            for activity in cat2.sub_items:
-                if not activity.skip_numbering:
-                    activity_count += 1
-                activity._counter = activity_count
-
-                choice_counter = 0
-                _add_responsible(activity.responsibles.all(), cat1, cat2, activity,
-                                 resp_count=True)
-                if all_responsibles:
-                    activity._responsibles.update(
-                        set(cat1.responsibles.all()) | set(cat2.responsibles.all()))
-                for choice in activity.sub_items:
-                    if not choice.skip_numbering:
-                        choice_counter += 1
-                    choice._counter = choice_counter
-                    _add_responsible(choice.responsibles.all(), cat1, cat2, activity, choice,
-                                     resp_count=True)
-                    if all_responsibles:
-                        choice._responsibles.update(set(activity.responsibles.all()) |
-                                                    set(cat1.responsibles.all()) |
-                                                    set(cat2.responsibles.all()))
-
-
-def shuffle_person_data(service_form: 'ServiceForm') -> None:
-    from .models import Participant, ResponsibilityPerson, Question
-    letters = len(string.ascii_letters)
-    forenames = set()
-    surnames = set()
-    participants = Participant.objects.filter(form_revision__form=service_form)
+    for cat1_counter, cat1 in enumerate(service_form.sub_items):
+        activity_count = init_category_counters(cat1, cat1_counter, activity_count,
+                                                all_responsibles)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_update(model: 'Type[Model]', rows: 'Sequence[tuple]', fields: 'Sequence[str]') -> None:
+    """
+    Update fields of many rows with one UPDATE query. Rows are tuples
+    (pk, value of fields[0], value of fields[1], ...).
+    Like QuerySet.update, this does not send any model signals.
+    """
+    if not rows:
+        return
+    updates = {}
+    for idx, name in enumerate(fields, 1):
+        updates[name] = Case(*(When(pk=row[0], then=Value(row[idx])) for row in rows),
+                             output_field=model._meta.get_field(name))
+    model.objects.filter(pk__in=[row[0] for row in rows]).update(**updates)
+
+
+def _shuffle_text(old: Optional[str]) -> Optional[str]:
+    if not old:
+        return old
+    return ''.join(c if c in '@ .,' else random.choice(string.ascii_letters) for c in old)
+
+
+def shuffle_person_data(service_form: 'ServiceForm',
+                        progress: 'Callable[[int, int], None]'=None) -> int:
+    """
+    Anonymize contact details of participants and responsibles and free text
+    answers of participants of service form.
+
+    Rows are read in chunks and written back with one UPDATE per chunk, calling
+    progress(done, total) after each chunk. Returns number of updated rows.
+    """
+    from .models import (Participant, ResponsibilityPerson, Question, ParticipationActivity,
+                         ParticipationActivityChoice, QuestionAnswer)
+    from . import report_data
+
+    chunk_size = getattr(settings, 'SHUFFLE_CHUNK_SIZE', 1000)
+    participants = Participant.objects.filter(form=service_form)
     responsibles = ResponsibilityPerson.objects.filter(form=service_form)
-    for p in chain(participants, responsibles):
-        for n in p.forenames.split(' '):
-            if n:
-                forenames.add(n.title())
-        for n in p.surname.split('-'):
-            if n:
-                surnames.add(n.title())
-
-    def shuffle(m, *attrs):
-        for a in attrs:
-            old = getattr(m, a)
-            if old:
-                new = [string.ascii_letters[random.randrange(0, letters)] for i in range(len(old))]
-                for i in range(len(old)):
-                    if old[i] in '@ .,':
-                        new[i] = old[i]
-                setattr(m, a, ''.join(new))
-        m.save()
-
-    def shuffle_question(q):
-        if q.question.answer_type in [Question.ANSWER_LONG_TEXT,
-                                      Question.ANSWER_SHORT_TEXT]:
-            shuffle(q, 'answer')
 
+    forenames = set()
+    surnames = set()
+    for qs in (participants, responsibles):
+        for forename, surname in qs.values_list('forenames', 'surname').iterator(chunk_size):
+            forenames.update(n.title() for n in forename.split(' ') if n)
+            surnames.update(n.title() for n in surname.split('-') if n)
     forenames = tuple(forenames)
     surnames = tuple(surnames)
 
     def valid_email(s):
         return re.sub('[^a-zA-Z@\.-]', '', s)
 
-    def shuffle_contact_details(p):
-        p.forenames = ' '.join(
-            forenames[random.randrange(0, len(forenames))] for i in range(random.randint(1, 2)))
-        p.surname = '-'.join(
-            surnames[random.randrange(0, len(surnames))] for i in range(random.randint(1, 2)))
-        if p.email:
-            p.email = valid_email(
-                '%s.%s@email.com' % (p.forenames.replace(' ', '.').lower(), p.surname.lower()))
-        if p.street_address:
-            p.street_address = 'Kontaktikatu %d' % random.randint(0, 99)
-        if p.postal_code:
-            p.postal_code = ''.join('%s' % random.randint(0, 9) for i in range(5))
-        if p.phone_number:
-            p.phone_number = ''.join('%s' % random.randint(0, 9) for i in range(9))
-        if p.city:
-            p.city = 'Hemilä'
-        p.save()
-
-    for p in chain(participants, responsibles):
-        shuffle_contact_details(p)
-
-    for p in participants:
-        for a in p.activities:
-            shuffle(a, 'additional_info')
-            for c in a.choices:
-                shuffle(c, 'additional_info')
-        for q in p.questions:
-            shuffle_question(q)
+    def shuffle_contact_details(row):
+        pk, email, street_address, postal_code, phone_number, city = row
+        forename = ' '.join(random.choice(forenames) for i in range(random.randint(1, 2)))
+        surname = '-'.join(random.choice(surnames) for i in range(random.randint(1, 2)))
+        if email:
+            email = valid_email(
+                '%s.%s@email.com' % (forename.replace(' ', '.').lower(), surname.lower()))
+        if street_address:
+            street_address = 'Kontaktikatu %d' % random.randint(0, 99)
+        if postal_code:
+            postal_code = ''.join('%s' % random.randint(0, 9) for i in range(5))
+        if phone_number:
+            phone_number = ''.join('%s' % random.randint(0, 9) for i in range(9))
+        if city:
+            city = 'Hemilä'
+        return pk, forename, surname, email, street_address, postal_code, phone_number, city
+
+    def shuffle_texts(row):
+        return (row[0],) + tuple(_shuffle_text(v) for v in row[1:])
+
+    contact_fields = ('email', 'street_address', 'postal_code', 'phone_number', 'city')
+    participant_filter = {'participant__form': service_form}
+    jobs = [
+        (participants, contact_fields, ('forenames', 'surname') + contact_fields,
+         shuffle_contact_details),
+        (responsibles, contact_fields, ('forenames', 'surname') + contact_fields,
+         shuffle_contact_details),
+        (ParticipationActivity.objects.filter(**participant_filter)
+         .exclude(additional_info=None).exclude(additional_info=''),
+         ('additional_info',), ('additional_info',), shuffle_texts),
+        (ParticipationActivityChoice.objects.filter(
+            activity__participant__form=service_form)
+         .exclude(additional_info=None).exclude(additional_info=''),
+         ('additional_info',), ('additional_info',), shuffle_texts),
+        (QuestionAnswer.objects.filter(
+            question__answer_type__in=(Question.ANSWER_LONG_TEXT, Question.ANSWER_SHORT_TEXT),
+            **participant_filter).exclude(answer=''),
+         ('answer',), ('answer',), shuffle_texts),
+    ]
+
+    total = sum(qs.count() for qs, *rest in jobs)
+    done = 0
+    for qs, read_fields, write_fields, shuffle in jobs:
+        rows = qs.order_by().values_list('pk', *read_fields).iterator(chunk_size)
+        for chunk in chunked(rows, chunk_size):
+            bulk_update(qs.model, [shuffle(row) for row in chunk], write_fields)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+
+    # Bulk updates bypass post_save signals
+    for revision_id in service_form.formrevision_set.values_list('pk', flat=True):
+        report_data.invalidate_snapshot(revision_id)
+    bump_participation_watermark(service_form.pk)
+    return done
 
 
 def count_for_responsible(resp: 'ResponsibilityPerson') -> int:
@@ -309,6 +448,33 @@ def count_for_responsible(resp: 'ResponsibilityPerson') -> int:
 def generate_uuid() -> str:
     return str(uuid.uuid4())
 
+
+def form_structure_version(form_id: int) -> str:
+    """
+    Version token of form structure (form settings, categories, activities, choices and
+    questions). Token is changed by signal handlers (see signals.py) whenever any of these
+    are saved or deleted, so it can be used as a part of cache keys.
+    """
+    return caches['persistent'].get_or_set('form_structure_version_%s' % form_id, generate_uuid)
+
+
+def bump_form_structure_version(form_id: int) -> None:
+    caches['persistent'].set('form_structure_version_%s' % form_id, generate_uuid())
+
+
+def participation_watermark(form_id: int) -> str:
+    """
+    Version token of data shown in reports of form besides form structure (ready participants,
+    their participations, answers and logs, and responsibles). Changed by
+    Participant.participation_changed and signal handlers (see signals.py).
+    """
+    return caches['persistent'].get_or_set('participation_watermark_%s' % form_id,
+                                           generate_uuid)
+
+
+def bump_participation_watermark(form_id: int) -> None:
+    caches['persistent'].set('participation_watermark_%s' % form_id, generate_uuid())
+
 ColorStr = str  # TODO: Type validation against RGB_REGEX.pattern?
 
 
@@ -332,6 +498,25 @@ def not_black(color: ColorStr) -> Optional[ColorStr]:
     return color if color != '#000000' else None
 
 
+ITEM_KEY_PREFIXES = {'level1category': 'c1', 'level2category': 'c2', 'activity': 'a',
+                     'activitychoice': 'ac'}
+PALETTE_LIGHTNESS_LEVELS = (0, 1, 2)
+
+
+def item_key(item: 'AbstractServiceFormItem') -> str:
+    """
+    Key of category, activity or choice that is unique within form, such as 'c1-12'.
+    """
+    return '%s-%s' % (ITEM_KEY_PREFIXES[item._meta.model_name], item.pk)
+
+
+def palette_class(item: 'AbstractServiceFormItem', lighter: int=0) -> str:
+    """
+    CSS class of background color of form item (see ServiceForm.palette).
+    """
+    return 'color-%s-%s' % (item_key(item), lighter)
+
+
 def color_for_count(count: int) -> ColorStr:
     if not count:
         return Color('white').get_hex()
@@ -359,10 +544,21 @@ def clean_session(request: HttpRequest):
         # request.session.clear()
 
 
-def get_responsible(request: HttpRequest):
+def get_responsible(request: HttpRequest) -> 'Optional[ResponsibilityPerson]':
+    """
+    Responsible authenticated in session, loaded with its form. Memoized per request
+    (as long as authenticated responsible in session stays the same).
+    """
     from .models import ResponsibilityPerson
     responsible_pk = request.session.get('authenticated_responsibility')
-    return ResponsibilityPerson.objects.filter(pk=responsible_pk).first()
+    memo = getattr(request, '_authenticated_responsible', None)
+    if memo is None or memo[0] != responsible_pk:
+        responsible = None
+        if responsible_pk is not None:
+            responsible = ResponsibilityPerson.objects.select_related('form').filter(
+                pk=responsible_pk).first()
+        memo = request._authenticated_responsible = (responsible_pk, responsible)
+    return memo[1]
 
 
 def safe_join(sep: str, args_generator: Iterable[str]):
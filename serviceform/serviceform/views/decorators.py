@@ -17,6 +17,7 @@
 # along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
 
 from functools import wraps
+from typing import Callable
 
 from django.conf import settings
 from django.contrib.auth.views import redirect_to_login
@@ -24,25 +25,54 @@ from django.core.exceptions import PermissionDenied
 from django.http import Http404, HttpResponseRedirect, HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import resolve
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from .. import models, utils
 
 
+def conditional_report(request: HttpRequest, service_form: models.ServiceForm,
+                       render: Callable[[], HttpResponse]) -> HttpResponse:
+    """
+    Answer 304 Not Modified if client has up to date version of report page,
+    otherwise call render (that does all the heavy work) and add ETag to response.
+    Permissions must be checked before calling this.
+    """
+    etag = utils.report_etag(request, service_form)
+    if etag:
+        response = get_conditional_response(request, etag=etag)
+        if response:
+            return response
+    response = render()
+    if etag and response.status_code == 200:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 def serviceform(function=None, check_form_permission=False, init_counters=False,
-                all_responsibles=True, fetch_participants=False):
+                all_responsibles=True, fetch_participants=False, conditional=False):
     def actual_decorator(func):
         @wraps(func)
         def wrapper(request: HttpRequest, slug: str,
                     *args, **kwargs) -> HttpResponse:
             service_form = get_object_or_404(models.ServiceForm.objects, slug=slug)
             request.service_form = service_form
-            if init_counters:
-                service_form.init_counters(all_responsibles)
-            if fetch_participants:
-                revision_name = utils.get_report_settings(request, 'revision')
-                utils.fetch_participants(service_form, revision_name=revision_name)
-            func_ = require_form_permissions(func) if check_form_permission else func
-            return func_(request, service_form, *args)
+
+            def render() -> HttpResponse:
+                if init_counters:
+                    service_form.init_counters(all_responsibles)
+                if fetch_participants:
+                    revision_name = utils.get_report_settings(request, 'revision')
+                    utils.fetch_participants(service_form, revision_name=revision_name)
+                return func(request, service_form, *args)
+
+            def view(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
+                if conditional:
+                    return conditional_report(request, service_form, render)
+                return render()
+
+            func_ = require_form_permissions(view) if check_form_permission else view
+            return func_(request, service_form)
 
         return wrapper
 
@@ -74,13 +104,14 @@ def require_authenticated_participant(function=None, check_flow=True):
             participant_pk = request.session.get('authenticated_participant')
             if participant_pk:
                 request.participant = participant = get_object_or_404(
-                    models.Participant.objects.all(),
+                    models.Participant.flow_queryset(),
                     pk=participant_pk,
                     status__in=models.Participant.EDIT_STATUSES)
+                request.service_form = participant.form
                 if check_flow:
                     # Check flow status
                     participant._current_view = current_view
-                    if not participant.can_access_view(current_view, auth=True):
+                    if not participant.flow_state.can_access(current_view, auth=True):
                         return participant.redirect_last()
                     rv = func(request, participant, *args, **kwargs)
                     if isinstance(rv, HttpResponseRedirect):
@@ -22,9 +22,11 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from django.http import HttpResponseRedirect, Http404, HttpRequest, HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect, Http404, HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import require_POST
 
 from .. import forms, models
 from ..utils import clean_session, user_has_serviceform_permission, expire_auth_link, decode
@@ -75,19 +77,27 @@ def email_verification(request: HttpRequest, participant: models.Participant) ->
                    'bootstrap_checkbox_disabled': True})
 
 
+def _can_skip_categories(participant: models.Participant) -> bool:
+    # Participant who has already finished participation view may edit any category
+    return (participant.can_access_view(participant.flow_state.next_view('participation'))
+            or participant.form.allow_skipping_categories)
+
+
 @require_authenticated_participant
 @require_published_form
 def participation(request: HttpRequest, participant: models.Participant,
                   cat_num: int) -> HttpResponse:
     cat_num = int(cat_num)
     service_form = participant.form
-    service_form.init_counters()
-
-    category = service_form.sub_items[cat_num] if service_form.flow_by_categories else None
-    num_categories = len(service_form.sub_items) if category else 0
+    if service_form.flow_by_categories:
+        num_categories = len(service_form.level1_categories)
+        if num_categories and cat_num >= num_categories:
+            raise Http404
+    else:
+        num_categories = 0
+        service_form.init_counters()
 
-    if participant.can_access_view(
-            participant.next_view_name) or service_form.allow_skipping_categories:
+    if _can_skip_categories(participant):
         max_cat = num_categories
     else:
         max_cat = int(request.session.get('max_category', 0))
@@ -95,6 +105,7 @@ def participation(request: HttpRequest, participant: models.Participant,
     if cat_num > max_cat:
         return HttpResponseRedirect(reverse('participation', args=(max_cat,)))
 
+    category = service_form.load_category(cat_num) if num_categories else None
     form = forms.ParticipationForm(request, participant, category)
     if request.method == 'POST':
         form = forms.ParticipationForm(request, participant, category, request.POST)
@@ -114,10 +125,30 @@ def participation(request: HttpRequest, participant: models.Participant,
                    'max_cat': max_cat})
 
 
+@require_POST
+@require_authenticated_participant(check_flow=False)
+@require_published_form
+def participation_autosave(request: HttpRequest, participant: models.Participant) -> HttpResponse:
+    """
+    Save single participation change (see forms.ParticipationChangeForm) via AJAX.
+    """
+    if not participant.can_access_view('participation'):
+        raise PermissionDenied
+    form = forms.ParticipationChangeForm(participant, request.POST)
+    if not form.is_valid():
+        return JsonResponse({'saved': False}, status=400)
+    # Same restriction as in participation view: categories must be filled in order
+    if participant.form.flow_by_categories and not _can_skip_categories(participant):
+        if form.cat_num > int(request.session.get('max_category', 0)):
+            raise PermissionDenied
+    form.save()
+    return JsonResponse({'saved': True})
+
+
 @require_authenticated_participant
 @require_published_form
 def questions(request: HttpRequest, participant: models.Participant) -> HttpResponse:
-    if not participant.form.questions:
+    if not participant.form.has_questions:
         return participant.redirect_next(request)
 
     form = forms.QuestionForm(request, participant)
@@ -155,7 +186,7 @@ def send_auth_link(request: HttpRequest, participant: models.Participant,
                    email: str) -> HttpResponse:
     if not email:
         raise Http404
-    p = get_object_or_404(models.Participant, email=email, form_revision__form=participant.form)
+    p = get_object_or_404(models.Participant, email=email, form_id=participant.form_id)
     p.send_participant_email(p.EmailIds.RESEND)
     messages.add_message(request, messages.INFO,
                          _('Authentication link was sent to email address {}.').format(email))
@@ -173,7 +204,7 @@ def auth_participant_common(request: HttpRequest, participant: models.Participan
         participant.status = models.Participant.STATUS_UPDATING
     elif participant.status == models.Participant.STATUS_INVITED:
         participant.status = models.Participant.STATUS_ONGOING
-    if participant.form_revision != participant.form_revision.form.current_revision:
+    if participant.form_revision_id != participant.form.current_revision_id:
         participant.last_finished_view = ''
     participant.save(
         update_fields=['status', 'last_finished_view', 'email_verified'])
@@ -189,14 +220,14 @@ def authenticate_participant_old(request: HttpRequest, uuid: str,
     if not uuid:
         raise Http404
     clean_session(request)
-    participant = get_object_or_404(models.Participant.objects.all(), secret_key=uuid)
+    participant = get_object_or_404(models.Participant.flow_queryset(), secret_key=uuid)
     return expire_auth_link(request, participant)
 
 
 def authenticate_participant(request: HttpRequest, participant_id: int, password: str,
                              next_view: str='contact_details') -> HttpResponse:
     clean_session(request)
-    participant = get_object_or_404(models.Participant.objects.all(), pk=participant_id)
+    participant = get_object_or_404(models.Participant.flow_queryset(), pk=participant_id)
     result = participant.check_auth_key(password)
     if result == participant.PasswordStatus.PASSWORD_NOK:
         messages.error(request, _(
@@ -214,7 +245,7 @@ def authenticate_participant(request: HttpRequest, participant_id: int, password
 def authenticate_participant_mock(request: HttpRequest, participant_id: int,
                                   next_view: str='contact_details') -> HttpResponse:
     clean_session(request)
-    participant = get_object_or_404(models.Participant.objects.all(), pk=participant_id)
+    participant = get_object_or_404(models.Participant.flow_queryset(), pk=participant_id)
     user_has_serviceform_permission(request.user, participant.form, raise_permissiondenied=True)
     return auth_participant_common(request, participant, next_view, email_verified=False)
 
@@ -25,12 +25,14 @@ from django.core.exceptions import PermissionDenied
 from django.urls import reverse
 from django.http import HttpResponseRedirect, Http404, HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.utils.cache import patch_cache_control
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.gzip import gzip_page
 
-from .. import models, forms
+from .. import models, forms, utils, report_data
 from ..utils import user_has_serviceform_permission, fetch_participants, expire_auth_link, decode, \
     RevisionOptions
-from .decorators import serviceform, require_authenticated_responsible
+from .decorators import serviceform, require_authenticated_responsible, conditional_report
 
 if TYPE_CHECKING:
     from serviceform.serviceform.models import Participant
@@ -89,30 +91,52 @@ def settings_view(request: HttpRequest, service_form: models.ServiceForm) -> Htt
                   {'service_form': service_form, 'form': form})
 
 
-@serviceform(check_form_permission=True, init_counters=True)
+@serviceform(check_form_permission=True, init_counters=True, conditional=True)
 def all_responsibles(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
     return render(request, 'serviceform/reports/all_responsibles.html',
                   {'service_form': service_form})
 
 
-@serviceform(check_form_permission=True, fetch_participants=True)
+@serviceform(check_form_permission=True, fetch_participants=True, conditional=True)
 def all_participants(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
     return render(request, 'serviceform/reports/all_participants.html',
                   {'service_form': service_form})
 
 
-@serviceform(check_form_permission=True, init_counters=True, fetch_participants=True)
+@serviceform(check_form_permission=True, init_counters=True, fetch_participants=True,
+             conditional=True)
 def all_activities(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
     return render(request, 'serviceform/reports/all_activities.html',
                   {'service_form': service_form})
 
 
-@serviceform(check_form_permission=True, init_counters=True, fetch_participants=True)
+@serviceform(check_form_permission=True, init_counters=True, fetch_participants=True,
+             conditional=True)
 def all_questions(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
     return render(request, 'serviceform/reports/all_questions.html',
                   {'service_form': service_form})
 
 
+@serviceform(check_form_permission=True)
+def statistics(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
+    revision_name = utils.get_report_settings(request, 'revision')
+    answer_statistics = service_form.answer_statistics(revision_name)
+    questions = [(q, answer_statistics['questions'].get(str(q.pk), {}))
+                 for q in service_form.questions]
+    return render(request, 'serviceform/reports/statistics.html',
+                  {'service_form': service_form,
+                   'participant_statistics': answer_statistics['participants'],
+                   'questions': questions})
+
+
+@gzip_page
+@serviceform(check_form_permission=True, conditional=True)
+def report_json(request: HttpRequest, service_form: models.ServiceForm) -> HttpResponse:
+    revision_name = utils.get_report_settings(request, 'revision')
+    return HttpResponse(report_data.report_json(service_form, revision_name),
+                        content_type='application/json')
+
+
 def participant_generate_new_auth_link(request: HttpRequest, participant_id: int) -> HttpResponse:
     if not request.user.is_staff:
         raise PermissionDenied
@@ -173,11 +197,14 @@ def view_responsible(request: HttpRequest, auth_responsible: models.Responsibili
         raise PermissionDenied
     service_form = responsible.form
     request.service_form = service_form
-    service_form.init_counters()
-    fetch_participants(service_form, revision_name=RevisionOptions.ALL)
-    return render(request, 'serviceform/reports/responsible.html',
-                  {'service_form': responsible.form, 'responsible': responsible,
-                   'show_report_btn': True})
+
+    def render_report() -> HttpResponse:
+        service_form.init_counters()
+        fetch_participants(service_form, revision_name=RevisionOptions.ALL)
+        return render(request, 'serviceform/reports/responsible.html',
+                      {'service_form': responsible.form, 'responsible': responsible,
+                       'show_report_btn': True})
+    return conditional_report(request, service_form, render_report)
 
 
 @require_authenticated_responsible
@@ -196,9 +223,25 @@ def preview_printable(request: HttpRequest, responsible: models.ResponsibilityPe
                       slug: str) -> HttpResponse:
     service_form = get_object_or_404(models.ServiceForm.objects, slug=slug)
     user_has_serviceform_permission(request.user, service_form)
-    service_form.init_counters()
-    return render(request, 'serviceform/preview_printable.html',
-                  {'form': service_form, 'preview': True, 'printable': True})
+
+    def render_preview() -> HttpResponse:
+        service_form.init_counters()
+        return render(request, 'serviceform/preview_printable.html',
+                      {'form': service_form, 'preview': True, 'printable': True})
+    return conditional_report(request, service_form, render_preview)
+
+
+def form_palette(request: HttpRequest, slug: str, version: str) -> HttpResponse:
+    """
+    Stylesheet with background color classes of form items. URL contains form structure
+    version, so current version may be cached by browsers for a long time.
+    """
+    service_form = get_object_or_404(models.ServiceForm.objects, slug=slug)
+    response = HttpResponse(service_form.palette_css(), content_type='text/css')
+    if version == utils.form_structure_version(service_form.pk):
+        patch_cache_control(response, public=True,
+                            max_age=getattr(settings, 'FORM_PALETTE_MAX_AGE', 60*60*24*365))
+    return response
 
 
 @require_authenticated_responsible
@@ -223,10 +266,13 @@ def responsible_report(request: HttpRequest,
     if responsible is None:
         raise PermissionDenied
     service_form = responsible.form
-    service_form.init_counters(all_responsibles=True)
-    fetch_participants(service_form, revision_name=RevisionOptions.ALL)
-    return render(request, 'serviceform/reports/responsible_anonymous.html',
-                  {'service_form': responsible.form, 'responsible': responsible})
+
+    def render_report() -> HttpResponse:
+        service_form.init_counters(all_responsibles=True)
+        fetch_participants(service_form, revision_name=RevisionOptions.ALL)
+        return render(request, 'serviceform/reports/responsible_anonymous.html',
+                      {'service_form': responsible.form, 'responsible': responsible})
+    return conditional_report(request, service_form, render_report)
 
 
 def logout_view(request: HttpRequest, **kwargs) -> HttpResponse:
@@ -19,8 +19,18 @@
 from django.contrib import admin
 
 from . import models
+from .pagination import EstimatedCountPaginator, KeysetChangeList
 
 
 @admin.register(models.Task)
 class TaskAdmin(admin.ModelAdmin):
-    pass
+    # Stored columns only: Task.__str__ would fetch target of every row
+    list_display = ('id', 'method_name', 'target_type', 'target_id', 'scheduled_time', 'status',
+                    'last_modified')
+    list_select_related = ('target_type',)
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
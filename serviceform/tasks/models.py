@@ -60,6 +60,10 @@ class Task(models.Model):
     data = models.TextField()  # JSON serialized arguments
     result = models.TextField()  # JSON serialized result of function
 
+    class Meta:
+        indexes = [models.Index(fields=['status', 'scheduled_time'],
+                                name='task_status_scheduled'), ]
+
     def __str__(self):
         return (f'{self.target}::{self.method_name} scheduled at '
                 f'{self.scheduled_time} ({self.status})')
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# (c) 2017 Tuomas Airaksinen
+#
+# This file is part of Serviceform.
+#
+# Serviceform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Serviceform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Serviceform.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional, Type
+
+from django.conf import settings
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Model
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'before'
+
+
+def estimated_count(model: 'Type[Model]', using: str='default') -> Optional[int]:
+    """
+    Row count of model's table as estimated by PostgreSQL planner (updated by
+    VACUUM and ANALYZE), or None if estimate is not available.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                       [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 for tables that have never been analyzed
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for big tables: exact COUNT(*) of an unfiltered table is replaced by
+    planner estimate, if table has more than ADMIN_ESTIMATED_COUNT_THRESHOLD rows.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate > getattr(
+                    settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000):
+                self.is_estimate = True
+                return estimate
+        return super().count
+
+    is_estimate = False
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages through rows in default (newest first) ordering with
+    'before' cursor (pk__lt) instead of OFFSET, which gets slower page by page.
+    Pages sorted by other columns are paginated normally.
+    """
+
+    def get_queryset(self, request):
+        # Cursor is not a filter, and other links must not keep it
+        self.params.pop(CURSOR_VAR, None)
+        return super().get_queryset(request)
+
+    def get_results(self, request):
+        super().get_results(request)
+        cursor = request.GET.get(CURSOR_VAR, '')
+        self.keyset = (ORDER_VAR not in self.params and self.multi_page
+                       and not (self.show_all and self.can_show_all))
+        self.cursor = int(cursor) if cursor.isdigit() else None
+        self.next_page_url = self.first_page_url = None
+        if self.keyset:
+            qs = self.queryset.order_by('-pk')
+            if self.cursor:
+                qs = qs.filter(pk__lt=self.cursor)
+                self.first_page_url = self.get_query_string(remove=[PAGE_VAR])
+            self.result_list = list(qs[:self.list_per_page])
+            if len(self.result_list) == self.list_per_page:
+                self.next_page_url = self.get_query_string(
+                    {CURSOR_VAR: self.result_list[-1].pk}, remove=[PAGE_VAR])
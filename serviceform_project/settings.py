@@ -356,3 +356,12 @@ SILENCED_SYSTEM_CHECKS = [
 AUTH_KEY_EXPIRE_DAYS = 3*30  # 3 months
 AUTH_STORE_KEYS = 10
 
+PARTICIPATION_COUNTS_CACHE_TIMEOUT = 5*60  # 5 minutes
+ANSWER_STATISTICS_CACHE_TIMEOUT = 5*60  # 5 minutes
+REPORT_FRAGMENT_CACHE_TIMEOUT = 60*60  # 1 hour
+REPORT_JSON_CACHE_TIMEOUT = 60*60  # 1 hour
+FORM_PALETTE_MAX_AGE = 60*60*24*365  # 1 year
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 10000
+EMAIL_DISPLAY_CACHE_TIMEOUT = 24*60*60  # 1 day
+SHUFFLE_CHUNK_SIZE = 1000
+PERMISSION_CACHE_TIMEOUT = 60  # 1 minute
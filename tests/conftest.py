@@ -23,6 +23,13 @@ def django_db_setup(django_db_setup, django_db_blocker):
         call_command('loaddata', os.path.join(os.path.dirname(__file__), 'test_data.json'))
 
 
+@pytest.fixture(autouse=True)
+def clear_persistent_cache():
+    # Report snapshots and structure versions must not outlive database rollback
+    yield
+    caches['persistent'].clear()
+
+
 @pytest.fixture(params=['__all', '__current', 'Vuosi-2016', 'Vuosi-2017'])
 def report_settings(request, mocker):
     revision_name = request.param
@@ -0,0 +1,34 @@
+from django.http import QueryDict
+from django.test import RequestFactory
+
+from serviceform.serviceform import forms, models
+
+
+def test_participation_form_validation_queries(participant: models.Participant,
+                                               django_assert_num_queries):
+    service_form = participant.form
+    service_form.init_counters()
+    activities = list(service_form.activities())
+    with_choices = next(a for a in activities if a.sub_items and a.multiple_choices_allowed)
+    without_choices = next(a for a in activities if not a.sub_items)
+
+    post_data = QueryDict(mutable=True)
+    post_data.update({
+        'SRV_ACTIVITY_%s' % without_choices.pk: 'on',
+        'SRV_ACTIVITY_EXTRA_%s' % without_choices.pk: 'extra info',
+        'SRV_ACTIVITY_%s' % with_choices.pk: 'on',
+        'SRV_CHOICE_%s' % with_choices.sub_items[0].pk: 'on',
+    })
+    request = RequestFactory().post('/')
+    form = forms.ParticipationForm(request, participant, post_data=post_data)
+    with django_assert_num_queries(0):
+        assert form.is_valid()
+    assert without_choices.extra == 'extra info'
+    assert form.selected_activities == {with_choices, without_choices}
+
+
+def test_participation_form_invalid_key(participant: models.Participant):
+    participant.form.init_counters()
+    post_data = QueryDict('SRV_ACTIVITY_abc=on')
+    form = forms.ParticipationForm(RequestFactory().post('/'), participant, post_data=post_data)
+    assert not form.is_valid()
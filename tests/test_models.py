@@ -0,0 +1,321 @@
+import hashlib
+import json
+import tracemalloc
+
+import pytest
+from django.core.cache import caches
+from django.db import connection
+from django.template import Context
+from django.utils import timezone
+from django.utils.safestring import SafeText
+from django.urls import reverse
+
+from serviceform.serviceform import models, utils
+from serviceform.serviceform.report_data import RevisionReport, ReportParticipant
+from serviceform.serviceform.templatetags import serviceform_tags
+from serviceform.tasks.models import Task
+
+
+def test_participation_counts(serviceform: models.ServiceForm, django_assert_num_queries):
+    caches['default'].clear()
+    with django_assert_num_queries(2):
+        counts = serviceform.participation_counts()
+    with django_assert_num_queries(0):
+        assert serviceform.participation_counts() == counts
+
+    ready = models.ParticipationActivity.objects.filter(
+        participant__form_revision=serviceform.current_revision,
+        participant__status__in=models.Participant.READY_STATUSES)
+    for activity in serviceform.activities():
+        assert counts['activities'].get(str(activity.pk), 0) == \
+               ready.filter(activity=activity).count()
+
+
+def test_load_category_numbering(serviceform: models.ServiceForm):
+    full = models.ServiceForm.objects.get(pk=serviceform.pk)
+    full.init_counters()
+    for cat_num, full_cat1 in enumerate(full.sub_items):
+        s = models.ServiceForm.objects.get(pk=serviceform.pk)
+        cat1 = s.load_category(cat_num)
+        assert cat1.pk == full_cat1.pk
+        assert [(a.pk, a.id_display) for c2 in cat1.sub_items for a in c2.sub_items] == \
+               [(a.pk, a.id_display) for c2 in full_cat1.sub_items for a in c2.sub_items]
+
+
+def test_participant_flow_state(participant: models.Participant):
+    participant.last_finished_view = 'contact_details'
+    flow = participant.flow_state
+    assert flow is participant.flow_state
+    assert flow.views[0] == 'contact_details'
+    assert flow.can_access(flow.views[1])
+    assert not flow.can_access(flow.views[2])
+    assert not flow.can_access('submitted')
+    assert participant.redirect_last().url == reverse(flow.views[1])
+
+    participant.last_finished_view = flow.views[1]
+    assert participant.flow_state is not flow
+    assert participant.flow_state.can_access(flow.views[2])
+
+
+def test_answer_statistics(serviceform: models.ServiceForm, django_assert_num_queries):
+    caches['default'].clear()
+    revision_name = '__all'
+    int_question = models.Question.objects.create(form=serviceform, question='Integer',
+                                                  answer_type=models.Question.ANSWER_INT)
+    date_question = models.Question.objects.create(form=serviceform, question='Date',
+                                                   answer_type=models.Question.ANSWER_DATE)
+    bool_question = models.Question.objects.create(form=serviceform, question='Boolean',
+                                                   answer_type=models.Question.ANSWER_BOOL)
+    ready = serviceform.ready_participants(revision_name)
+    for p, answer in zip(ready, ['1', '2', '2', '5', 'not a number']):
+        models.QuestionAnswer.objects.create(participant=p, question=int_question, answer=answer)
+    for p, answer in zip(ready, ['2017-02-01', '2016-12-24', 'tomorrow']):
+        models.QuestionAnswer.objects.create(participant=p, question=date_question, answer=answer)
+    for p, answer in zip(ready, ['on', 'on', 'False']):
+        models.QuestionAnswer.objects.create(participant=p, question=bool_question, answer=answer)
+    statistics = serviceform.answer_statistics(revision_name)
+    with django_assert_num_queries(0):
+        assert serviceform.answer_statistics(revision_name) == statistics
+
+    participants = serviceform.ready_participants(revision_name)
+    assert statistics['participants']['count'] == participants.count()
+    ages = [p.age for p in participants if p.year_of_birth]
+    age = statistics['participants']['age']
+    assert age['count'] == len(ages)
+    if ages:
+        assert (age['min'], age['max']) == (min(ages), max(ages))
+        assert sum(c for v, c, pct in statistics['participants']['age_histogram']) == len(ages)
+    for q in serviceform.questions:
+        answered = models.QuestionAnswer.objects.filter(
+            question=q, participant__in=participants).exclude(answer='').count()
+        assert statistics['questions'][str(q.pk)]['answered'] == answered
+
+    int_stats = statistics['questions'][str(int_question.pk)]
+    assert int_stats['summary'] == {'count': 4, 'mean': 2.5, 'min': 1, 'max': 5,
+                                    'percentiles': [1.75, 2.0, 2.75]}
+    assert int_stats['histogram'] == [[1, 1, 25.0], [2, 2, 50.0], [5, 1, 25.0]]
+    assert statistics['questions'][str(date_question.pk)]['range'] == ['2016-12-24', '2017-02-01']
+    bool_stats = statistics['questions'][str(bool_question.pk)]
+    assert (bool_stats['yes'], bool_stats['no']) == (2, participants.count() - 2)
+
+    # New answers are shown without waiting for cache timeout
+    participant = participants.exclude(questionanswer__question=bool_question).first()
+    models.QuestionAnswer.objects.create(participant=participant, question=bool_question,
+                                         answer='on')
+    participant.participation_changed()
+    bool_stats = serviceform.answer_statistics(revision_name)['questions'][str(bool_question.pk)]
+    assert bool_stats['yes'] == 3
+
+
+def test_report_snapshot(serviceform: models.ServiceForm, django_assert_num_queries):
+    revision = serviceform.formrevision_set.get(name='Vuosi-2016')
+    assert revision.is_closed
+    revision.participant_set.filter(status=models.Participant.STATUS_UPDATING).update(
+        status=models.Participant.STATUS_FINISHED)
+    report = RevisionReport.for_revision(revision)
+    assert report.is_final and report.participants
+
+    with django_assert_num_queries(0):
+        snapshot = RevisionReport.for_revision(revision)
+    assert snapshot.participants.keys() == report.participants.keys()
+    for pk, p in snapshot.participants.items():
+        assert p.item_count == models.Participant.objects.get(pk=pk).item_count
+        assert p.form_revision == revision
+    assert {k: [i.pk for i in v] for k, v in snapshot.activities.items()} == \
+        {k: [i.pk for i in v] for k, v in report.activities.items()}
+    assert {k: [i.pk for i in v] for k, v in snapshot.choices.items()} == \
+        {k: [i.pk for i in v] for k, v in report.choices.items()}
+    assert {k: [i.answer for i in v] for k, v in snapshot.answers.items()} == \
+        {k: [i.answer for i in v] for k, v in report.answers.items()}
+
+    # Participant moving to current revision invalidates snapshot
+    participant = revision.participant_set.get(pk=next(iter(report.participants)))
+    participant.form_revision = serviceform.current_revision
+    participant.save()
+    report = RevisionReport.for_revision(revision)
+    assert participant.pk not in report.participants
+    assert participant.pk not in RevisionReport.for_revision(revision).participants
+
+
+def test_responsible_links(serviceform: models.ServiceForm, django_assert_num_queries):
+    caches['default'].clear()
+    links = serviceform.responsible_links()
+    items = [i for c1 in serviceform.sub_items for c2 in c1.sub_items for a in c2.sub_items
+             for i in [c1, c2, a, *a.sub_items]]
+    assert any(i.responsibles.exists() for i in items)
+    for item in items:
+        responsibles = list(item.responsibles.all())
+        if not responsibles:
+            assert utils.item_key(item) not in links
+            continue
+        item_links = links[utils.item_key(item)]
+        url = reverse('view_responsible', args=(responsibles[0].pk,))
+        assert item_links[''].count('<a ') == len(responsibles)
+        assert f'href="{url}">{responsibles[0]}</a>' in item_links['']
+        assert f'href="{url}"' not in item_links[str(responsibles[0].pk)]
+
+    fresh = models.ServiceForm.objects.get(pk=serviceform.pk)
+    with django_assert_num_queries(0):
+        assert fresh.responsible_links() == links
+
+    # Changing responsibles of item makes links outdated
+    activity = items[2]
+    responsible = serviceform.responsibilityperson_set.exclude(
+        pk__in=activity.responsibles.all()).first()
+    activity.responsibles.add(responsible)
+    serviceform = models.ServiceForm.objects.get(pk=serviceform.pk)
+    links = serviceform.responsible_links()
+    assert str(responsible.pk) in links[utils.item_key(activity)]
+
+    # Participants and responsible logins do not affect links
+    serviceform.participant_set.first().save()
+    responsible.save(update_fields=['auth_keys_hash_storage'])
+    fresh = models.ServiceForm.objects.get(pk=serviceform.pk)
+    with django_assert_num_queries(0):
+        assert fresh.responsible_links() == links
+
+    # Renaming responsible does
+    responsible.surname = 'Renamed'
+    responsible.save()
+    fresh = models.ServiceForm.objects.get(pk=serviceform.pk)
+    assert 'Renamed' in fresh.responsible_links()[utils.item_key(activity)]['']
+
+
+def test_responsible_link_tag_without_service_form(serviceform: models.ServiceForm):
+    activity = models.Activity.objects.filter(category__category__form=serviceform,
+                                              responsibles__isnull=False).first()
+    responsibles = list(activity.responsibles.all())
+    context = Context({'service_form': serviceform, 'responsible': responsibles[0]})
+    expected = serviceform_tags.responsible_link(context, activity)
+    assert expected
+    assert serviceform_tags.responsible_link(Context({'responsible': responsibles[0]}),
+                                             activity) == expected
+
+
+def test_report_participant_memory(serviceform: models.ServiceForm):
+    qs = models.Participant.objects.filter(status__in=models.Participant.READY_STATUSES)
+    rows = list(qs.values_list(*ReportParticipant.FIELDS))
+    assert len(rows) > 10
+
+    def peak_memory(load) -> int:
+        tracemalloc.start()
+        loaded = load()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert len(loaded) == len(rows)
+        return peak
+
+    report = RevisionReport(serviceform.current_revision, [], [], [], [])
+    full = peak_memory(lambda: list(qs.prefetch_related('participantlog_set__written_by')))
+    compact = peak_memory(lambda: [ReportParticipant(report, r) for r in
+                                   qs.values_list(*ReportParticipant.FIELDS)])
+    assert compact * 2 < full
+
+
+def test_create_deep_copy(serviceform: models.ServiceForm, django_assert_max_num_queries):
+    def tree(service_form: models.ServiceForm) -> list:
+        service_form = models.ServiceForm.objects.get(pk=service_form.pk)
+        items = [i for c1 in service_form.sub_items for c2 in c1.sub_items
+                 for a in c2.sub_items for i in [c1, c2, a, *a.sub_items]]
+        items += list(service_form.questions.prefetch_related('responsibles'))
+        return [(type(i), str(i), sorted(str(r) for r in i.responsibles.all())) for i in items]
+
+    # Number of queries does not depend on size of form
+    c2 = models.Level2Category.objects.filter(category__form=serviceform).first()
+    models.Activity.objects.bulk_create(
+        models.Activity(category=c2, name=f'Extra activity {i}', order=1000 + i)
+        for i in range(1000))
+    with django_assert_max_num_queries(30):
+        copy = serviceform.create_deep_copy()
+
+    assert copy.slug != serviceform.slug
+    assert tree(copy) == tree(serviceform)
+    assert copy.responsible.form == copy
+    assert copy.email_to_participant.form == copy
+    assert copy.current_revision.form == copy
+    assert not models.ResponsibilityPerson.objects.filter(
+        activity_related__category__category__form=copy).exclude(form=copy).exists()
+    assert not models.Level1Category.objects.filter(form=copy).filter(
+        pk__in=serviceform.level1category_set.all()).exists()
+
+
+@pytest.fixture
+def no_seqscan(db):
+    # Test tables are tiny, so planner would always prefer sequential scans
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+
+@pytest.mark.parametrize('query, index', [
+    (lambda sf: sf.ready_participants(utils.RevisionOptions.ALL),
+     'participant_revision_status'),
+    (lambda sf: sf.ready_participants(sf.current_revision.name),
+     'participant_revision_status'),
+    (lambda sf: models.Participant.objects.filter(email='a@b.fi', form=sf),
+     'participant_form_email'),
+    (lambda sf: models.ParticipationActivity.objects.filter(
+        activity=next(sf.activities()),
+        participant__in=sf.ready_participants(utils.RevisionOptions.ALL)),
+     'participationact_activity'),
+    (lambda sf: models.QuestionAnswer.objects.filter(
+        question=sf.questions[0],
+        participant__in=sf.ready_participants(utils.RevisionOptions.ALL)),
+     'questionanswer_question'),
+    (lambda sf: models.EmailMessage.objects.filter(sent_at__isnull=True).order_by('pk'),
+     'emailmessage_unsent'),
+    (lambda sf: Task.objects.filter(status=Task.REQUESTED, scheduled_time__lte=timezone.now()),
+     'task_status_scheduled'),
+])
+def test_query_uses_index(serviceform: models.ServiceForm, no_seqscan, query, index):
+    assert index in query(serviceform).explain()
+
+
+def test_participant_form_maintained(serviceform: models.ServiceForm,
+                                     django_assert_num_queries):
+    participant = models.Participant.objects.create(form_revision=serviceform.current_revision)
+    assert participant.form_id == serviceform.pk
+    other = serviceform.create_deep_copy()
+    participant.form_revision = other.current_revision
+    participant.save(update_fields=['form_revision'])
+    participant.refresh_from_db()
+    assert participant.form_id == other.pk
+
+    has_questions = other.question_set.exists()
+    with django_assert_num_queries(1):
+        participant = models.Participant.flow_queryset().get(pk=participant.pk)
+        assert participant.form.current_revision == other.current_revision
+        assert participant.form.has_questions == has_questions
+
+    participant.form_revision = None
+    participant.save(update_fields=['form_revision'])
+    participant.refresh_from_db()
+    assert participant.form_id is None
+
+
+def test_load_category_does_not_count_responsibles(serviceform: models.ServiceForm):
+    utils._responsible_counts.clear()
+    serviceform.load_category(0)
+    assert not utils._responsible_counts
+
+
+def test_email_display_cache_keeps_safe_strings(serviceform: models.ServiceForm):
+    cache = caches['default']
+    cache.clear()
+    message = models.EmailMessage.objects.create(
+        template=serviceform.emailtemplate_set.first(), to_address='user@example.com',
+        from_address='test@example.com', subject='Hello {{ name }}',
+        content='<b>{{ name }}</b>', context='{"name": "user"}')
+    models.EmailMessage.prefetch_display([message])
+    assert isinstance(message.content_display(), SafeText)
+
+    # Emulate JSON serializer of production cache: values come back as plain str
+    key = 'email_display_%s' % hashlib.md5(json.dumps(
+        [message.subject, message.content, message.context]).encode('utf-8')).hexdigest()
+    cache.set(key, json.loads(json.dumps(cache.get(key))))
+    assert type(cache.get(key)[1]) is str
+
+    message = models.EmailMessage.objects.get(pk=message.pk)
+    models.EmailMessage.prefetch_display([message])
+    assert isinstance(message.subject_display(), SafeText)
+    assert isinstance(message.content_display(), SafeText)
+    assert message.content_display() == '<b>user</b>'
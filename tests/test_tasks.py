@@ -1,6 +1,8 @@
+from django.db import connection
 from django.utils import timezone
 
 from serviceform.tasks.models import Task
+from serviceform.tasks.pagination import EstimatedCountPaginator
 from serviceform.serviceform import models
 
 def test_tasks(serviceform: models.ServiceForm):
@@ -25,3 +27,20 @@ def test_tasks_canceled(serviceform: models.ServiceForm):
     serviceform.refresh_from_db()
     assert serviceform.current_revision == cur_rev
 
+
+def test_estimated_count_paginator(serviceform: models.ServiceForm, settings):
+    for i in range(20):
+        Task.make(serviceform.create_initial_data, scheduled_time=timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE tasks_task')
+    qs = Task.objects.order_by('-pk')
+
+    paginator = EstimatedCountPaginator(qs, 10)
+    assert paginator.count == qs.count() and not paginator.is_estimate
+
+    settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 0
+    paginator = EstimatedCountPaginator(qs, 10)
+    assert paginator.count == qs.count() and paginator.is_estimate
+    paginator = EstimatedCountPaginator(qs.filter(status=Task.REQUESTED), 10)
+    assert paginator.count == qs.filter(status=Task.REQUESTED).count()
+    assert not paginator.is_estimate
@@ -1,6 +1,96 @@
-from serviceform.serviceform.utils import shuffle_person_data
+from django.contrib.auth.models import Group
+from django.urls import reverse
+from guardian.shortcuts import assign_perm, remove_perm
+
+from serviceform.serviceform import models, navigation
+from serviceform.serviceform.utils import (shuffle_person_data, user_has_serviceform_permission,
+                                           get_responsible)
 
 
 def test_shuffle(serviceform):
     # just check that this does not crash...
     shuffle_person_data(serviceform)
+
+
+def test_shuffle_chunked(serviceform, settings):
+    settings.SHUFFLE_CHUNK_SIZE = 3
+    participants = models.Participant.objects.filter(form_revision__form=serviceform)
+    emails = dict(participants.exclude(email='').values_list('pk', 'email'))
+    progress = []
+
+    updated = shuffle_person_data(serviceform, progress=lambda *args: progress.append(args))
+
+    assert updated > len(emails)
+    assert progress[-1] == (updated, updated)
+    assert all(done <= 3 * (i + 1) for i, (done, total) in enumerate(progress))
+    new_emails = dict(participants.exclude(email='').values_list('pk', 'email'))
+    assert new_emails.keys() == emails.keys()
+    assert all(new_emails[pk] != email for pk, email in emails.items())
+    assert all(email.endswith('@email.com') for email in new_emails.values())
+
+
+def test_serviceform_permission_cache(serviceform, django_user_model, django_assert_num_queries):
+    user = django_user_model.objects.create_user('perm_user')
+    assert not user_has_serviceform_permission(user, serviceform, raise_permissiondenied=False)
+
+    group = Group.objects.create(name='perm_group')
+    assign_perm('serviceform.can_access_serviceform', group, serviceform)
+    group.user_set.add(user)
+    user = django_user_model.objects.get(pk=user.pk)
+    with django_assert_num_queries(1):
+        assert user_has_serviceform_permission(user, serviceform)
+        assert user_has_serviceform_permission(user, serviceform)
+    # Shared cache
+    user = django_user_model.objects.get(pk=user.pk)
+    with django_assert_num_queries(0):
+        assert user_has_serviceform_permission(user, serviceform)
+
+    remove_perm('serviceform.can_access_serviceform', group, serviceform)
+    user = django_user_model.objects.get(pk=user.pk)
+    assert not user_has_serviceform_permission(user, serviceform, raise_permissiondenied=False)
+    assign_perm('serviceform.can_access_serviceform', user, serviceform)
+    user = django_user_model.objects.get(pk=user.pk)
+    assert user_has_serviceform_permission(user, serviceform)
+
+
+def test_get_responsible_memoized(rf, responsible, django_assert_num_queries):
+    request = rf.get('/')
+    request.session = {}
+    with django_assert_num_queries(0):
+        assert get_responsible(request) is None
+
+    request.session['authenticated_responsibility'] = responsible.pk
+    with django_assert_num_queries(1):
+        assert get_responsible(request) == responsible
+        assert get_responsible(request).form == responsible.form
+        assert get_responsible(request) is get_responsible(request)
+
+    del request.session['authenticated_responsibility']
+    assert get_responsible(request) is None
+
+
+def test_navigation_url_templates(serviceform, responsible, mocker):
+    assert navigation.url_template('participation', 1).format(3) == \
+        reverse('participation', args=(3,))
+    assert navigation.url_template('preview').format() == reverse('preview')
+    assert navigation.url_template('report', 1).format(serviceform.slug) == \
+        reverse('report', args=(serviceform.slug,))
+    assert navigation.url_template('authenticate_participant_new', 2).format(12, 'a-b_c') == \
+        reverse('authenticate_participant_new', args=(12, 'a-b_c'))
+
+    entries = navigation.menu('report', serviceform, None)
+    assert [e.url for e in entries if e.name == 'admin:serviceform_serviceform_change'] == \
+        [reverse('admin:serviceform_serviceform_change', args=(serviceform.pk,))]
+    assert 'responsible_report' not in [e.name for e in entries]
+    responsible.show_full_report = False
+    assert 'to_full_report' not in [e.name for e in
+                                    navigation.menu('anonymous_report', serviceform, responsible)]
+    responsible.show_full_report = True
+    assert 'responsible_report' in [e.name for e in
+                                    navigation.menu('report', serviceform, responsible)]
+
+    # Compiled menus are rendered without resolver
+    reverse_mock = mocker.patch('serviceform.serviceform.navigation.reverse')
+    assert navigation.menu('report', serviceform, None) == entries
+    assert navigation.menu('report', serviceform, responsible)
+    assert not reverse_mock.called
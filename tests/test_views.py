@@ -1,4 +1,6 @@
 #from django.test import TestCase
+import gzip
+import json
 import os
 from datetime import timedelta
 from itertools import chain
@@ -7,11 +9,17 @@ from typing import List
 import pytest
 
 # Hit admin pages (create new, update existing) but do not try to create any real content
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.db import connection
 from django.db.models import QuerySet
 from django.test import Client
 from django.utils import timezone
+from guardian.shortcuts import assign_perm
 
-from serviceform.serviceform import models
+from serviceform.serviceform import models, utils
+from serviceform.tasks.pagination import CURSOR_VAR
 
 SLUG = 'jklvapis'
 
@@ -25,6 +33,102 @@ def test_hit_admin_pages(report_settings, db, admin_client: Client):
     assert b'asdf asfd asdf asdf' in res.content
 
 
+def test_admin_serviceform_changelist_num_queries(serviceform: models.ServiceForm,
+                                                  admin_client: Client, admin_user,
+                                                  django_assert_max_num_queries,
+                                                  django_assert_num_queries):
+    page = '/admin/serviceform/serviceform/'
+    admin_client.get(page)  # warm up content type cache etc.
+    with django_assert_max_num_queries(20) as queries:
+        assert admin_client.get(page).status_code == Http.OK
+    # Captured queries are read from connection's log, which is reset by next request
+    num_queries = len(queries)
+
+    for i in range(5):
+        service_form = models.ServiceForm.objects.create(name=f'Extra form {i}',
+                                                         slug=f'extra-form-{i}')
+        service_form.create_initial_data()
+        assign_perm('serviceform.can_access_serviceform', admin_user, service_form)
+    with django_assert_num_queries(num_queries):
+        res = admin_client.get(page)
+    assert res.status_code == Http.OK
+    assert b'Extra form 4' in res.content
+    assert serviceform.participation_count().encode('utf-8') in res.content
+
+
+def test_admin_copy_forms_requires_add_permission(db, rf, django_user_model):
+    admin = site._registry[models.ServiceForm]
+    request = rf.get('/admin/serviceform/serviceform/')
+    request.user = django_user_model.objects.create_user('staff', is_staff=True)
+    assert 'copy_forms' not in admin.get_actions(request)
+    request.user.user_permissions.add(Permission.objects.get(codename='add_serviceform'))
+    request.user = django_user_model.objects.get(pk=request.user.pk)
+    assert 'copy_forms' in admin.get_actions(request)
+
+
+def test_admin_participant_changelist(serviceform: models.ServiceForm, admin_client: Client,
+                                      django_user_model, rf, settings,
+                                      django_assert_max_num_queries):
+    page = '/admin/serviceform/participant/'
+    admin_client.get(page)  # warm up content type cache etc.
+    with django_assert_max_num_queries(8):
+        res = admin_client.get(page)
+    assert res.status_code == Http.OK
+    participant = models.Participant.objects.filter(
+        participationactivity__isnull=False).order_by('-pk').first()
+    assert participant.activities_display().encode('utf-8') in res.content
+
+    # Big table: no exact count, no OFFSET
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE serviceform_participant')
+    settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 0
+    with django_assert_max_num_queries(8) as queries:
+        res = admin_client.get(page)
+        assert not any('COUNT(' in q['sql'] for q in queries.captured_queries)
+    assert res.status_code == Http.OK
+    assert res.context['cl'].paginator.is_estimate
+    with django_assert_max_num_queries(8) as queries:
+        res = admin_client.get(page + res.context['cl'].next_page_url)
+        assert not any('OFFSET' in q['sql'] for q in queries.captured_queries)
+    assert res.status_code == Http.OK
+
+    settings.OTHER_CAN_SEE_DATA = False
+    user = django_user_model.objects.create_user('staff', is_staff=True)
+    assign_perm('serviceform.can_access_serviceform', user, serviceform)
+    request = rf.get(page)
+    request.user = user
+    qs = site._registry[models.Participant].get_queryset(request)
+    assert not qs.query.distinct
+    assert set(qs.values_list('pk', flat=True)) == set(models.Participant.objects.filter(
+        form_revision__form=serviceform).values_list('pk', flat=True))
+
+
+def test_admin_emailmessage_keyset_pagination(serviceform: models.ServiceForm,
+                                              admin_client: Client,
+                                              django_assert_max_num_queries):
+    template = serviceform.emailtemplate_set.first()
+    models.EmailMessage.objects.bulk_create(
+        models.EmailMessage(template=template, to_address=f'user{i}@example.com',
+                            from_address='test@example.com', subject='Hello {{ name }}',
+                            content='Content {{ name }}', context=f'{{"name": "user{i}"}}')
+        for i in range(250))
+    page = '/admin/serviceform/emailmessage/'
+    pks = []
+    url = page
+    while url:
+        with django_assert_max_num_queries(10) as queries:
+            res = admin_client.get(url)
+            assert not any('OFFSET' in q['sql'] for q in queries.captured_queries)
+        assert res.status_code == Http.OK
+        cl = res.context['cl']
+        pks.extend(m.pk for m in cl.result_list)
+        url = cl.next_page_url and page + cl.next_page_url
+    assert pks == list(models.EmailMessage.objects.order_by('-pk').values_list('pk', flat=True))
+    res = admin_client.get(page)
+    assert b'Hello user249' in res.content
+    assert f'?{CURSOR_VAR}='.encode('utf-8') in res.content
+
+
 def test_hit_admin_reports(db, report_settings, admin_client: Client):
     p = models.Participant.objects.filter(form_revision__form__slug=SLUG).first()
     r = models.ResponsibilityPerson.objects.filter(form__slug=SLUG).first()
@@ -34,6 +138,7 @@ def test_hit_admin_reports(db, report_settings, admin_client: Client):
                 f"/report/{SLUG}/all_activities/",
                 f"/report/{SLUG}/settings/",
                 f"/report/{SLUG}/all_questions/",
+                f"/report/{SLUG}/statistics/",
                 f"/report/participant/{p.pk}/",
                 f"/report/responsible/{r.pk}/",
                 f"/invite/{SLUG}/",
@@ -119,6 +224,7 @@ class Pages:
     CONTACT = '/participant/contact/'
     EMAIL_VERIFICATION = '/participant/email_verification/'
     PARTICIPATION = '/participant/participation/'
+    PARTICIPATION_AUTOSAVE = '/participant/participation/autosave/'
     PARTICIPATIONX = '/participant/participation/%d/'
 
     PARTICIPATION0 = '/participant/participation/0/'
@@ -676,3 +782,208 @@ def test_unsubscribe_responsible(client: Client, responsible: models.Responsibil
 # Test task processor
 # Test login views more carefully (email sending etc)
 
+
+def test_participation_autosave(serviceform: models.ServiceForm, admin_client: Client):
+    rev = serviceform.current_revision
+    rev.valid_from = timezone.now() - timedelta(days=10)
+    rev.valid_to = timezone.now() + timedelta(days=10)
+    rev.save()
+    participant = models.Participant.objects.filter(
+        form_revision=rev, status=models.Participant.STATUS_FINISHED).first()
+    participant.last_finished_view = 'preview'
+    participant.save(update_fields=['last_finished_view'])
+    res = admin_client.get(f'/anonymous/authenticate_participant_mock/{participant.pk}/')
+    assert res.status_code == Http.REDIR
+
+    activity = next(a for a in serviceform.activities()
+                    if a.sub_items and a.multiple_choices_allowed)
+    choice = activity.sub_items[0]
+    pacts = participant.participationactivity_set.filter(activity=activity)
+    pacts.delete()
+
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_CHOICE_{choice.pk}', 'checked': 'true'})
+    assert res.status_code == Http.OK
+    assert pacts.get().choices_set.get().activity_choice == choice
+
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_CHOICE_EXTRA_{choice.pk}', 'value': 'extra'})
+    assert res.status_code == Http.OK
+    assert pacts.get().choices_set.get().additional_info == 'extra'
+
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_CHOICE_{choice.pk}', 'checked': 'false'})
+    assert res.status_code == Http.OK
+    assert not pacts.exists()
+
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': 'SRV_CHOICE_0', 'checked': 'true'})
+    assert res.status_code == 400
+
+
+def test_participation_autosave_category_order(serviceform: models.ServiceForm,
+                                               admin_client: Client):
+    serviceform.flow_by_categories = True
+    serviceform.allow_skipping_categories = False
+    serviceform.require_email_verification = False
+    serviceform.save()
+    rev = serviceform.current_revision
+    rev.valid_from = timezone.now() - timedelta(days=10)
+    rev.valid_to = timezone.now() + timedelta(days=10)
+    rev.save()
+    participant = models.Participant.objects.filter(
+        form_revision=rev, status=models.Participant.STATUS_FINISHED).first()
+    participant.last_finished_view = 'contact_details'
+    participant.save(update_fields=['last_finished_view'])
+    res = admin_client.get(f'/anonymous/authenticate_participant_mock/{participant.pk}/')
+    assert res.status_code == Http.REDIR
+
+    first, second = [models.Activity.objects.filter(category__category=c).first()
+                     for c in serviceform.level1_categories[:2]]
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_ACTIVITY_{first.pk}', 'checked': 'true'})
+    assert res.status_code == Http.OK
+    # Categories are filled in order, like in participation view
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_ACTIVITY_{second.pk}', 'checked': 'true'})
+    assert res.status_code == Http.FORBIDDEN
+
+    participant.last_finished_view = 'participation'
+    participant.save(update_fields=['last_finished_view'])
+    res = admin_client.post(Pages.PARTICIPATION_AUTOSAVE,
+                            {'name': f'SRV_ACTIVITY_{second.pk}', 'checked': 'true'})
+    assert res.status_code == Http.OK
+
+
+@pytest.mark.parametrize('page, num_queries', [
+    (Pages.CONTACT, 3),
+    (Pages.PARTICIPATION0, 13),
+    (Pages.QUESTIONS, 4),
+    (Pages.PREVIEW, 4),
+])
+def test_participation_flow_num_queries(serviceform: models.ServiceForm, admin_client: Client,
+                                        django_assert_num_queries, page, num_queries):
+    rev = serviceform.current_revision
+    rev.valid_from = timezone.now() - timedelta(days=10)
+    rev.valid_to = timezone.now() + timedelta(days=10)
+    rev.save()
+    participant = models.Participant.objects.filter(
+        form_revision=rev, status=models.Participant.STATUS_FINISHED).first()
+    participant.last_finished_view = 'preview'
+    participant.save(update_fields=['last_finished_view'])
+    admin_client.get(f'/anonymous/authenticate_participant_mock/{participant.pk}/')
+    caches['default'].clear()
+    serviceform.palette()  # computed once per structure version
+
+    with django_assert_num_queries(num_queries):
+        res = admin_client.get(page)
+    assert res.status_code == Http.OK
+
+
+def test_all_questions_num_queries(serviceform: models.ServiceForm, report_settings,
+                                   admin_client: Client, django_assert_max_num_queries,
+                                   django_assert_num_queries):
+    page = f'/report/{SLUG}/all_questions/'
+    admin_client.get(page)  # warm up content type cache etc.
+    with django_assert_max_num_queries(20) as queries:
+        assert admin_client.get(page).status_code == Http.OK
+    # Captured queries are read from connection's log, which is reset by next request
+    num_queries = len(queries)
+
+    question = models.Question.objects.create(form=serviceform, question='Extra question')
+    participants = models.Participant.objects.filter(
+        form_revision__form=serviceform, status__in=models.Participant.READY_STATUSES)
+    for participant in participants:
+        models.QuestionAnswer.objects.create(participant=participant, question=question,
+                                             answer='Answer')
+    admin_client.get(page)  # structure changed: re-create report snapshots
+    with django_assert_num_queries(num_queries):
+        res = admin_client.get(page)
+    assert res.status_code == Http.OK
+    assert b'Extra question' in res.content
+
+
+def test_report_fragment_cache(serviceform: models.ServiceForm, report_settings,
+                               admin_client: Client, django_assert_max_num_queries):
+    caches['default'].clear()
+    page = f'/report/{SLUG}/all_participants/'
+    admin_client.get(page)
+    with django_assert_max_num_queries(20) as queries:
+        res = admin_client.get(page)
+    assert res.status_code == Http.OK
+    assert not [q for q in queries if 'serviceform_participant"' in q['sql']]
+
+    participant = serviceform.ready_participants(
+        utils.get_report_settings(None, 'revision')).first()
+    participant.surname = 'Changed-Surname'
+    participant.save()
+    res = admin_client.get(page)
+    assert b'Changed-Surname' in res.content
+
+
+def test_report_conditional_get(serviceform: models.ServiceForm, admin_client: Client,
+                                client: Client, django_assert_max_num_queries):
+    page = f'/report/{SLUG}/all_activities/'
+    res = admin_client.get(page)
+    assert res.status_code == Http.OK
+    etag = res['ETag']
+    with django_assert_max_num_queries(5):
+        res = admin_client.get(page, HTTP_IF_NONE_MATCH=etag)
+    assert res.status_code == 304
+
+    # Permissions are checked before validator
+    assert client.get(page, HTTP_IF_NONE_MATCH=etag).status_code == Http.REDIR
+
+    participant = serviceform.ready_participants(utils.RevisionOptions.CURRENT).first()
+    participant.finish(from_user=False)
+    res = admin_client.get(page, HTTP_IF_NONE_MATCH=etag)
+    assert res.status_code == Http.OK
+    assert res['ETag'] != etag
+
+
+def test_report_json(serviceform: models.ServiceForm, report_settings, admin_client: Client):
+    html = admin_client.get(f'/report/{SLUG}/all_activities/')
+    res = admin_client.get(f'/report/{SLUG}/api/v1/report.json', HTTP_ACCEPT_ENCODING='gzip')
+    assert res.status_code == Http.OK
+    assert res['Content-Encoding'] == 'gzip'
+    assert len(res.content) * 10 < len(html.content)
+    data = json.loads(gzip.decompress(res.content))
+    assert data['version'] == 1
+
+    participants = data['participants']
+    assert len({len(column) for column in participants.values()}) == 1
+    revision_name = utils.get_report_settings(None, 'revision')
+    assert sorted(participants['id']) == sorted(
+        serviceform.ready_participants(revision_name).values_list('pk', flat=True))
+    participant_ids = set(participants['id'])
+    assert set(data['activities']['participant']) <= participant_ids
+    structure = data['structure']
+    activity_ids = {i for i, t in zip(structure['id'], structure['type']) if t == 'activity'}
+    assert set(data['activities']['id']) <= activity_ids
+    assert len(data['activities']['id']) == models.ParticipationActivity.objects.filter(
+        participant__in=participant_ids).count()
+
+
+def test_form_palette(serviceform: models.ServiceForm, admin_client: Client):
+    c1 = serviceform.sub_items[0]
+    cls = utils.palette_class(c1)
+    palette_url = serviceform.palette_url
+    res = admin_client.get(f'/report/{SLUG}/all_activities/')
+    assert palette_url in res.content.decode('utf-8')
+    assert f'class="report-category-1-title {cls}"' in res.content.decode('utf-8')
+
+    res = admin_client.get(palette_url)
+    assert res.status_code == Http.OK
+    assert res['Content-Type'] == 'text/css'
+    assert 'max-age' in res['Cache-Control']
+    css = res.content.decode('utf-8')
+    assert f'.{cls}{{background:{c1.background_color_display} !important}}' in css
+
+    serviceform.level1_color = '#123456'
+    serviceform.save()
+    serviceform = models.ServiceForm.objects.get(pk=serviceform.pk)
+    assert serviceform.palette_url != palette_url
+    res = admin_client.get(palette_url)
+    assert 'max-age' not in res.get('Cache-Control', '')
+    c1 = serviceform.sub_items[0]
+    assert f'{{background:{c1.background_color_display} ' in res.content.decode('utf-8')